@@ -1,5 +1,4 @@
 from datetime import datetime
-from bs4 import BeautifulSoup
 import pandas as pd
 import requests
 import logging
@@ -8,6 +7,15 @@ import shutil
 import time
 import csv
 import os
+import sys
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import scraper_common
+from scraper_common import (
+    timed, RateLimiter, ResponseCache, StageTimer, FixtureStore, RetryPolicy, BaseScraper,
+    resolve_excel_engine, resolve_html_parser,
+)
 
 
 # region configuration
@@ -17,7 +25,39 @@ output_filename = (
     job_name.split("using")[0].strip().lower().replace(" ", "-") + "-sample.csv"
 )
 scrape_datetime = datetime.utcnow()
+output_format = os.environ.get("OUTPUT_FORMAT", "csv")  # csv, parquet or arrow
+parquet_compression = "zstd"
 proxy_address = os.environ.get("HTTP_PROXY")
+pool_connections = 4  # Number of hosts kept in the connection pool
+pool_maxsize = 10  # Keep-alive connections kept per host
+rate_limits = {
+    # host: requests per second, burst size, max extra jitter in seconds
+    "www.npa.go.jp": {"rate": 0.5, "burst": 2, "jitter": 0.5},
+    "www.e-stat.go.jp": {"rate": 0.5, "burst": 2, "jitter": 0.5},
+}
+default_rate_limit = {"rate": 0.5, "burst": 1, "jitter": 0.5}
+retry_statuses = {429, 500, 502, 503, 504}  # Responses worth retrying a single request for
+retry_backoff_base = 2  # Seconds before the first retry, doubled on every attempt
+retry_backoff_max = 60  # Upper bound for a single backoff in seconds
+retry_after_max = 300  # Longest Retry-After honoured, asking for more gives up on the request
+retry_budget = 20  # Request retries allowed across a whole run
+http_mode = os.environ.get("HTTP_MODE", "live")  # live, record or replay
+html_parser = os.environ.get("HTML_PARSER", "lxml")  # BeautifulSoup backend, html.parser is the fallback
+fixtures_dir = os.path.abspath("fixtures")  # Where record mode saves responses and replay mode reads them
+output_schema = {
+    # column: (type, format used to parse it) for parquet/arrow output
+    "scrape_datetime": ("timestamp", None),
+    "PERIOD_START": ("date", "%Y-%m-%d"),
+    "PERIODICITY": ("string", None),
+    "METRIC": ("string", None),
+    "UNIT": ("string", None),
+    "VALUE": ("float", None),
+}
+cache_dir = os.path.abspath("http_cache")  # Conditional-GET cache for downloaded artifacts
+cache_max_bytes = 500 * 1024 * 1024  # Least recently used files are evicted past this size
+excel_engine = os.environ.get("EXCEL_ENGINE", "calamine")  # Rust-backed calamine, or a pandas engine such as openpyxl
+history_filename = "history.csv"
+incremental_mode = os.environ.get("INCREMENTAL", "0") == "1"  # Only fetch months published after the latest PERIOD_START in history_filename
 
 
 headers = {
@@ -40,7 +80,7 @@ headers = {
 
 # region DECORATORS
 def retry(RETRY_START_SCRAPER):
-    RETRIES = 5
+    RETRIES = 2  # Last resort only, single requests are retried in make_request
     reattempt_delay_time = int(1.5 * 60)  # In seconds -> Actual delay will be +-20 sec
 
     def wrapper(self, *args, **kwargs):
@@ -70,12 +110,29 @@ def retry(RETRY_START_SCRAPER):
 # endregion
 
 
+def make_sink(filename, columns):
+    return scraper_common.make_sink(
+        filename, columns, output_format, output_schema, parquet_compression
+    )
+
+
 # region Scraper_Class
-class Scraper:
+class Scraper(BaseScraper):
     def __init__(self):
         
         self.MASTER_DF = pd.DataFrame()
+        super().__init__(pool_connections, pool_maxsize, headers)
+        self.sink = None
+        self.rate_limiter = RateLimiter(rate_limits, default_rate_limit)
+        self.retry_policy = RetryPolicy(retry_statuses, retry_backoff_base, retry_backoff_max, retry_after_max, retry_budget)
+        self.timer = StageTimer(job_name, scrape_datetime)
+        self.html_parser = resolve_html_parser(html_parser)
+        self.fixtures = FixtureStore(fixtures_dir, http_mode)
+        self.cache = ResponseCache(cache_dir, cache_max_bytes)
+        self.excel_engine = resolve_excel_engine(excel_engine)
         self.historical = None
+        self.watermark = None
+        self.rows_streamed = 0
         self.my_dir = None
         
 
@@ -128,8 +185,47 @@ class Scraper:
             s.params.update(params)
         
         return s
+
     # endregion
     
+    def read_watermark(self):
+        # Latest PERIOD_START already stored, used as the incremental starting point
+        if not os.path.exists(history_filename):
+            logging.info(f"{history_filename} not found, running a full scrape ...")
+            return None
+
+        history = pd.read_csv(history_filename, usecols=['PERIOD_START'], dtype=str)
+        if history.empty:
+            return None
+        return history['PERIOD_START'].max()
+
+    def merge_into_history(self, new_rows):
+        history = pd.DataFrame(columns=self.output_columns)
+        if os.path.exists(history_filename):
+            history = pd.read_csv(history_filename, dtype=str)
+
+        history = pd.concat([history, new_rows.astype(str)], ignore_index=True)
+        history = history.drop_duplicates(subset=['PERIOD_START', 'METRIC'], keep='last')
+
+        temp_filename = history_filename + ".tmp"
+        history.to_csv(
+            temp_filename,
+            encoding="utf-8",
+            quotechar='"',
+            quoting=csv.QUOTE_ALL,
+            index=False,
+        )
+        os.replace(temp_filename, history_filename)
+        logging.info(f"Merged {len(new_rows)} new rows into {history_filename}")
+
+    def stream_new_rows(self):
+        # Hand the rows added to self.output since the previous call to the output sink
+        new_rows = self.output.iloc[self.rows_streamed:]
+        self.rows_streamed = len(self.output)
+        if self.watermark is not None and not new_rows.empty:
+            new_rows = new_rows[new_rows['PERIOD_START'] > self.watermark]
+        self.write_rows(new_rows)
+
     def create_dir(self):
 
         temp = "resources"
@@ -155,21 +251,8 @@ class Scraper:
     
     
     # start helper fucntions
-    def make_request(self, url, max_retries=3):
-        session = self.make_session(headers)
-        for attempt in range(max_retries):
-            time.sleep(random.uniform(2.5, 3.5))
-            response = session.get(url, timeout = 90)
-            if response.status_code == 200:
-                return response
-            else:
-                logging.error(f"Error: {response.status_code}. Retrying in 5 seconds...")
-                time.sleep(random.uniform(5, 10))
-        logging.error(f"Failed to retrieve data after {max_retries} attempts")
-        return response
-
     def read_nov_file(self, excel_path):
-       self.month_df = pd.read_excel(excel_path, skiprows=5,  header=None, index_col=False)
+       self.month_df = self.load_excel(excel_path, skiprows=5,  header=None, index_col=False)
        self.month_df = self.month_df.dropna(axis=1, how='all')
        self.month_df = self.month_df.dropna(axis = 0, how = 'all')
        nov_column_names = [
@@ -193,7 +276,7 @@ class Scraper:
        return self.month_df
    
     def read_dec_file(self, excel_path):
-        self.dec_df = pd.read_excel(excel_path, skiprows=4,  header=None, index_col=False, usecols=lambda x: x not in [0])
+        self.dec_df = self.load_excel(excel_path, skiprows=4,  header=None, index_col=False, usecols=lambda x: x not in [0])
         self.dec_df = self.dec_df.dropna(axis = 1, how='all')
         self.dec_df = self.dec_df.dropna(axis = 0, how = 'all')
         
@@ -207,6 +290,7 @@ class Scraper:
         return self.dec_df
      
 
+    @timed("transform")
     def update_output_dataframe(self, year, month):
         logging.info(f"Appending data for the {year} ...")
     
@@ -282,7 +366,7 @@ class Scraper:
 
     def download_and_rename_xlsx(self, excel_url, download_path, month, year):
         
-        response = self.make_request(excel_url)
+        response = self.make_request(excel_url, cache=True)
         
         if response.status_code == 200:
         
@@ -309,7 +393,7 @@ class Scraper:
        
     def download_and_rename_xls(self, excel_url, download_path, month, year):
         
-        response = self.make_request(excel_url)
+        response = self.make_request(excel_url, cache=True)
         
         if response.status_code == 200:
             
@@ -348,7 +432,7 @@ class Scraper:
         if response.status_code == 200:
             logging.info(f"Successful reqesut at monthly report page for {month}:{year} at :{url}")
             try:
-                soup = BeautifulSoup(response.content, 'html.parser')
+                soup = self.make_soup(response.content)
                 div = soup.find('div', class_ = 'stat-dataset_list-body')
                 articles = div.find_all('article', class_ = 'stat-dataset_list-item')
                 
@@ -408,7 +492,7 @@ class Scraper:
                         if dec_response.status_code == 200:
                             print("Successful request at dec_url:", dec_url)
                             
-                            soup = BeautifulSoup(dec_response.content, 'html.parser')
+                            soup = self.make_soup(dec_response.content)
                             div = soup.find('div', class_ = 'stat-dataset_list-body')
                             article = div.find('article', class_ = 'stat-dataset_list-item')
 
@@ -444,7 +528,7 @@ class Scraper:
         if response.status_code == 200:
             logging.info(f"Successful reqesut at {base_url}")
             
-            soup = BeautifulSoup(response.content, 'html.parser')
+            soup = self.make_soup(response.content)
             div = soup.find('div', class_="anchorLink")
             next_sibling = div.find_next_sibling()
             
@@ -470,6 +554,14 @@ class Scraper:
                     
                     last_month = monthly_reports[-1]
                     
+                    if self.watermark is not None:
+                        month_number = datetime.strptime(last_month['Month'], '%B').month
+                        latest_period = f"{last_month['Year']}-{month_number:02d}-01"
+                        if latest_period <= self.watermark:
+                            logging.info(f"Nothing published for {year} after {self.watermark} ...")
+                            self.MASTER_DF = self.output
+                            break
+                    
                     if last_month['Month'] != 'December':
                         url = last_month['Link']
                         month = last_month['Month']
@@ -494,7 +586,8 @@ class Scraper:
                             self.download_csv(url, year_folder, month, year)
                             
                     shutil.rmtree(year_folder)
-                    if not self.historical:
+                    self.stream_new_rows()
+                    if not self.historical and self.watermark is None:
                         logging.info(f"Done with scraping data for {year}")
                         self.MASTER_DF = self.output
                         break
@@ -508,13 +601,22 @@ class Scraper:
             logging.error(f"Request failed with status code: {response.status_code}")
             success = False 
         
+        if self.watermark is not None and not self.MASTER_DF.empty:
+            self.MASTER_DF = self.MASTER_DF[self.MASTER_DF['PERIOD_START'] > self.watermark]
+            logging.info(f"{len(self.MASTER_DF)} rows published after {self.watermark}")
+
         # endregion
         return success
 
     # region START_SCRAPER
     @retry
-    def start_scraper(self, historical) -> list:
+    def start_scraper(self, historical, incremental=False) -> list:
         self.historical = historical
+        if self.sink is not None:
+            self.sink.open()
+        self.rows_streamed = 0
+        if incremental:
+            self.watermark = self.read_watermark()
         page_url = f"{base_url}"
         success = self.scrape_data(page_url)
 
@@ -528,33 +630,38 @@ class Scraper:
     # endregion
 
 
-def run(filename: str):
+def run(filename: str, incremental: bool = incremental_mode):
     scraper = Scraper()
-    success = scraper.start_scraper(historical=True)
+    try:
+        scraper.sink = make_sink(filename, scraper.output_columns)
+    except ValueError as e:
+        logging.info(f"{e} OUTPUT FILE NOT GENERATED.")
+        return
+
+    try:
+        success = scraper.start_scraper(historical=True, incremental=incremental)
+    finally:
+        scraper.close_session()
+        scraper.sink.close()
+        logging.info("STAGE TIMINGS\n" + scraper.timer.summary(scraper.sink.rows_written))
+        scraper.timer.save(os.path.splitext(filename)[0] + "-timings.json", scraper.sink.rows_written)
 
     if not success:
-        logging.error("FINAL ATTEMPT FAILED. EXITING...")
+        logging.error(f"FINAL ATTEMPT FAILED. PARTIAL OUTPUT KEPT IN {scraper.sink.temp_filename}. EXITING...")
         return
 
-    outputs = scraper.MASTER_DF
-    
-    if not outputs.empty:
-        if outputs.columns[0] == "scrape_datetime":
-            logging.info("GENERATING FINAL OUTPUT...")
-            outputs.to_csv(
-                filename,
-                encoding="utf-8",
-                quotechar='"',
-                quoting=csv.QUOTE_ALL,
-                index=False,
-            )
-        else:
-            logging.info(
-                'MISSING "scrape_datetime" COLUMN OR IT IS NOT THE FIRST COLUMN. CSV FILE NOT GENERATED.'
-            )
+    if scraper.sink.rows_written:
+        logging.info("GENERATING FINAL OUTPUT...")
+        scraper.sink.finalize()
+        if incremental:
+            scraper.merge_into_history(scraper.MASTER_DF)
     else:
-        logging.error("No data scraped ...")
-    
+        os.remove(scraper.sink.temp_filename)
+        if incremental:
+            logging.info("No new months published since the last run ...")
+        else:
+            logging.error("No data scraped ...")
+
 
 if __name__ == "__main__":
     run(filename=output_filename)
@@ -3,19 +3,31 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.common.by import By
 from selenium import webdriver
 from datetime import datetime
-from bs4 import BeautifulSoup
+from urllib.parse import urlparse, urljoin, urlencode, urlsplit, urlunsplit, parse_qsl
 import pandas as pd
 import warnings
+import asyncio
 import requests
 import logging
+import hashlib
+import json
+import threading
 import random
 import time
 import csv
 import os
+import sys
 
 warnings.filterwarnings("ignore")
 
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import scraper_common
+from scraper_common import (
+    timed, RateLimiter, StageTimer, FixtureStore, DriverPool, RetryPolicy, BaseScraper,
+    resolve_html_parser,
+)
+
 
 base_url = "https://www.dexus.com"
 job_name = "15141_Dexus_Jack_IPD Scrape using requests"
@@ -23,11 +35,45 @@ output_filename = (
     job_name.split("using")[0].strip().lower().replace(" ", "-") + "-sample.csv"
 )
 scrape_datetime = datetime.utcnow()
+output_format = os.environ.get("OUTPUT_FORMAT", "csv")  # csv, parquet or arrow
+parquet_compression = "zstd"
 proxy_address = os.environ.get("HTTP_PROXY")
+pool_connections = 4  # Number of hosts kept in the connection pool
+pool_maxsize = 10  # Keep-alive connections kept per host
+rate_limits = {
+    # host: requests per second, burst size, max extra jitter in seconds
+    "www.dexus.com": {"rate": 1.0, "burst": 4, "jitter": 0.5},
+}
+default_rate_limit = {"rate": 0.5, "burst": 1, "jitter": 0.5}
+retry_statuses = {429, 500, 502, 503, 504}  # Responses worth retrying a single request for
+retry_backoff_base = 2  # Seconds before the first retry, doubled on every attempt
+retry_backoff_max = 60  # Upper bound for a single backoff in seconds
+retry_after_max = 300  # Longest Retry-After honoured, asking for more gives up on the request
+retry_budget = 20  # Request retries allowed across a whole run
+http_mode = os.environ.get("HTTP_MODE", "live")  # live, record or replay
+html_parser = os.environ.get("HTML_PARSER", "lxml")  # BeautifulSoup backend, html.parser is the fallback
+fixtures_dir = os.path.abspath("fixtures")  # Where record mode saves responses and replay mode reads them
+headless = os.environ.get("HEADLESS", "1") == "1"  # Run Chrome without a window
+category_concurrency = 4  # Category listings crawled at the same time
+driver_pool_size = category_concurrency  # One warm browser per category so browser fallbacks never queue for a driver
+driver_max_pages = 25  # Pages a browser serves before it is replaced
+output_schema = {
+    # column: (type, format used to parse it) for parquet/arrow output, other columns are strings
+    "scrape_datetime": ("timestamp", None),
+}
+concurrency_limit = 8  # Property pages fetched at the same time
+per_host_limit = 4  # Concurrent requests allowed against a single host
+listing_mode = os.environ.get("LISTING_MODE", "http")  # http pages the "Load More" endpoint directly, browser always renders in Chrome
+listing_max_pages = 100  # Safety stop when paging the "Load More" endpoint
+change_detection = os.environ.get("CHANGE_DETECTION", "0") == "1"  # Only re-scrape properties whose card or page changed
+snapshot_filename = "property_snapshot.json"  # Fingerprints and suites of every property from the last successful run
+skip_unchanged_cards = os.environ.get("SKIP_UNCHANGED_CARDS", "0") == "1"  # Reuse stored suites when a card is unchanged and the page has no validators to recheck
+unchanged_card_max_age = 24 * 60 * 60  # Seconds suites may be reused that way before the page is fetched and fingerprinted again
+suite_key_columns = ['data_url', 'Level', 'Space options']  # Identify one suite across runs
 
 
 def retry(RETRY_START_SCRAPER):
-    RETRIES = 5
+    RETRIES = 2  # Last resort only, single requests are retried in make_request
     reattempt_delay_time = int(1.5 * 60)
 
     def wrapper(self, *args, **kwargs):
@@ -54,10 +100,101 @@ def retry(RETRY_START_SCRAPER):
     return wrapper
 
 
-class Scraper:
+def fingerprint(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class PropertySnapshot:
+    # Card and page fingerprints with the suites of every property, compared against the previous run
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.current = {}
+        try:
+            with open(path, encoding="utf-8") as f:
+                self.previous = json.load(f)
+        except (OSError, ValueError):
+            self.previous = {}
+
+    def validators(self, url):
+        entry = self.previous.get(url) or {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def keep(self, url):
+        # Carries the previous entry over when the property was skipped, not modified or failed to load
+        with self.lock:
+            if url in self.previous:
+                self.current[url] = self.previous[url]
+
+    def update(self, url, card, df, response):
+        # The page is fingerprinted by its parsed suites, so changing page chrome does not count as a change
+        rows = df.fillna("").astype(str).to_dict("records")
+        body = fingerprint(json.dumps(rows, sort_keys=True))
+        previous = self.previous.get(url)
+        if previous is not None and previous["body"] == body:
+            logging.info(f"Suites unchanged for {url}")
+        with self.lock:
+            self.current[url] = {
+                "card": card,
+                "body": body,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "fetched_at": time.time(),
+                "rows": rows,
+            }
+
+    def suites(self, entries):
+        suites = {}
+        for url, entry in entries.items():
+            for row in entry["rows"]:
+                row = dict(row, data_url=url)
+                suites[tuple(row.get(column, "") for column in suite_key_columns)] = row
+        return suites
+
+    def diff(self, columns):
+        previous, current = self.suites(self.previous), self.suites(self.current)
+        changes = []
+        for key, row in current.items():
+            if key not in previous:
+                changes.append(dict(row, change="added"))
+            elif row != previous[key]:
+                changes.append(dict(row, change="changed"))
+        for key, row in previous.items():
+            if key not in current:
+                changes.append(dict(row, change="removed"))
+        return pd.DataFrame(changes, columns=["change"] + columns)
+
+    def save(self):
+        temp_path = self.path + ".part"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.current, f)
+        os.replace(temp_path, self.path)
+
+
+def make_sink(filename, columns):
+    return scraper_common.make_sink(
+        filename, columns, output_format, output_schema, parquet_compression
+    )
+
+
+class Scraper(BaseScraper):
     def __init__(self):
-        self.MASTER_DF = pd.DataFrame()
-        
+        self.output_columns = ['scrape_datetime', 'data_url', 'Address', 'Level', 'Space options', 'Availability', 'Price from', 'Outgoings', 'Floor area', 'Fitout']
+        super().__init__(pool_connections, pool_maxsize)
+        self.sink = None
+        self.rate_limiter = RateLimiter(rate_limits, default_rate_limit)
+        self.retry_policy = RetryPolicy(retry_statuses, retry_backoff_base, retry_backoff_max, retry_after_max, retry_budget)
+        self.timer = StageTimer(job_name, scrape_datetime)
+        self.html_parser = resolve_html_parser(html_parser)
+        self.fixtures = FixtureStore(fixtures_dir, http_mode)
+        self.driver_pool = None
+        self.snapshot = None
+        self.card_fingerprints = {}
 
         self.DEBUG = False
         if self.DEBUG:
@@ -83,9 +220,7 @@ class Scraper:
             proxies = None
         return proxies
 
-    def load_driver(self, downloads_path=None):
-        hdr = "Mozilla/5.0 (Linux; Android 6.0; Nexus 5 Build/MRA58N) AppleWebKit/537.36 \
-          (KHTML, like Gecko) Chrome/119.0.0.0 Mobile Safari/537.36"
+    def make_driver(self, downloads_path=None):
         proxies = self.get_proxies()
 
         prefs = {}
@@ -98,6 +233,8 @@ class Scraper:
 
         # Chrome options
         chrome_options = webdriver.ChromeOptions()
+        if headless:
+            chrome_options.add_argument("--headless=new")
         chrome_options.add_argument("start-maximized")
         chrome_options.add_argument("--no-sandbox")
         chrome_options.add_argument("--disable-gpu")
@@ -115,18 +252,27 @@ class Scraper:
         if proxy_address:
             chrome_options.add_argument('--proxy-server='+proxy_address)
 
-        self.driver = webdriver.Chrome(options=chrome_options)
-        self.driver.execute_cdp_cmd('Network.setUserAgentOverride', {
+        driver = webdriver.Chrome(options=chrome_options)
+        driver.execute_cdp_cmd('Network.setUserAgentOverride', {
             "userAgent": 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'})
-        self.driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
-        self.driver.maximize_window()
-
-        self.driver.get("https://www.google.com/")
-        self.wait_for_page_to_load()
-
-
-    def wait_for_page_to_load(self):
-        while not self.driver.execute_script(
+        driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
+        if not headless:
+            driver.maximize_window()
+        return driver
+
+    def get_driver_pool(self):
+        # Browsers are started on first use and reused by every page that needs one
+        if self.driver_pool is None:
+            self.driver_pool = DriverPool(self.make_driver, driver_pool_size, driver_max_pages)
+        return self.driver_pool
+
+    def close_driver_pool(self):
+        if self.driver_pool is not None:
+            self.driver_pool.close()
+            self.driver_pool = None
+
+    def wait_for_page_to_load(self, driver):
+        while not driver.execute_script(
             "return document.readyState === 'complete';"
         ):
             time.sleep(1)
@@ -152,9 +298,9 @@ class Scraper:
         return element
     
     def get_soup(self, driver):
-        html_content = self.driver.page_source
+        html_content = driver.page_source
 
-        soup = BeautifulSoup(html_content, 'html.parser')
+        soup = self.make_soup(html_content)
 
         return soup
 
@@ -170,119 +316,318 @@ class Scraper:
         
         return s
 
-    def make_request(self, url, max_retries=3):
-        session = self.make_session()
-        for attempt in range(max_retries):
-            time.sleep(random.uniform(2.5, 3.5))
-            response = session.get(url, timeout = 90)
-            if response.status_code == 200:
-                return response
-            else:
-                logging.error(f"Error: {response.status_code}. Retrying in 5 seconds...")
-                time.sleep(random.uniform(5, 10))
-        logging.error(f"Failed to retrieve data after {max_retries} attempts")
-        return response
-
+    def parse_property_page(self, content):
+        property_page_soup = self.make_soup(content)
+        address_div = property_page_soup.find('div', class_='address-bar')
+        address = address_div.find('p').text.strip()
+
+        availibility_div = property_page_soup.find('div', class_='component availability col-12 theme-enabled')
+        table = availibility_div.find('table')
+
+        headers = [th.text.strip() for th in table.find('thead').find_all('th')]
+        headers = [header.replace(", pa", "") if header.endswith(", pa") else header for header in headers]
+        headers = [header.replace("Space Options", "Space options").replace("Fit-out", "Fitout") for header in headers]
+
+        rows = []
+        for tr in table.find('tbody').find_all('tr'):
+            row = [td.text.strip() for td in tr.find_all('td')]
+            rows.append(row)
+
+        df = pd.DataFrame(rows, columns=headers)
+        df = df.loc[:, df.columns.notnull() & (df.columns != '')]
+        df['Address'] = address
+
+        return df
+
+    def scrape_changed_property_page(self, property_url):
+        # Unchanged cards are rechecked with a conditional request, or reuse their stored suites outright
+        card = self.card_fingerprints.get(property_url)
+        previous = self.snapshot.previous.get(property_url)
+        headers = {}
+        if previous is not None and previous["card"] == card:
+            headers = self.snapshot.validators(property_url)
+            # Cards do not show suite availability, so a skipped page is still refetched once it is old enough
+            fresh = time.time() - previous.get("fetched_at", 0) < unchanged_card_max_age
+            if not headers and skip_unchanged_cards and fresh:
+                logging.info(f"Card unchanged, reusing stored suites for {property_url}")
+                self.snapshot.keep(property_url)
+                return pd.DataFrame(previous["rows"])
+
+        property_url_response = self.make_request(property_url, headers=headers)
+        if property_url_response.status_code == 304 and previous is not None:
+            logging.info(f"Not modified, reusing stored suites for {property_url}")
+            self.snapshot.keep(property_url)
+            return pd.DataFrame(previous["rows"])
+
+        property_data = self.parse_property_page(property_url_response.content)
+        self.snapshot.update(property_url, card, property_data, property_url_response)
+        return property_data
 
     def scrape_property_page(self, property_url):
-        address = ""
         try:
+            if self.snapshot is not None:
+                return self.scrape_changed_property_page(property_url)
             property_url_response = self.make_request(property_url)
-            property_page_soup = BeautifulSoup(property_url_response.content, 'html.parser')
-            address_div = property_page_soup.find('div', class_='address-bar')
-            address = address_div.find('p').text.strip()
-
-            availibility_div = property_page_soup.find('div', class_='component availability col-12 theme-enabled')
-            table = availibility_div.find('table')
-
-            headers = [th.text.strip() for th in table.find('thead').find_all('th')]
-            headers = [header.replace(", pa", "") if header.endswith(", pa") else header for header in headers]
-            headers = [header.replace("Space Options", "Space options").replace("Fit-out", "Fitout") for header in headers]
-
-            rows = []
-            for tr in table.find('tbody').find_all('tr'):
-                row = [td.text.strip() for td in tr.find_all('td')]
-                rows.append(row)
-
-            df = pd.DataFrame(rows, columns=headers)
-            df = df.loc[:, df.columns.notnull() & (df.columns != '')]
-            df['Address'] = address
-
-            return df
+            return self.parse_property_page(property_url_response.content)
         except Exception as e:
+            if self.snapshot is not None:
+                self.snapshot.keep(property_url)
             # Create a DataFrame with the data_url column
             property_data = pd.DataFrame({'data_url': [property_url]})
             logging.error(f"Error while scraping property page: {e}")
             return property_data# Return an empty DataFrame on error
 
+    async def scrape_property_pages(self, properties, emit):
+        # Fan out over every property at once, bounded globally and per host.
+        # Finished pages are handed to emit in listing order as soon as their turn comes.
+        semaphore = asyncio.Semaphore(concurrency_limit)
+        host_semaphores = {}
+        finished = {}
+        next_index = 0
+
+        async def scrape_one(index, property_title, property_url):
+            nonlocal next_index
+            host = urlparse(property_url).netloc
+            if host not in host_semaphores:
+                host_semaphores[host] = asyncio.Semaphore(per_host_limit)
+
+            async with semaphore, host_semaphores[host]:
+                logging.info(f"Scraping data for {property_title}...")
+                finished[index] = await asyncio.to_thread(self.scrape_property_page, property_url)
+
+            while next_index in finished:
+                emit(*properties[next_index], finished.pop(next_index))
+                next_index += 1
+
+        await asyncio.gather(
+            *(scrape_one(index, property_title, property_url) for index, (property_title, property_url) in enumerate(properties))
+        )
+
+    def write_property(self, property_title, property_url, property_data):
+        if not property_data.empty:
+            property_data['scrape_datetime'] = scrape_datetime
+            property_data['data_url'] = property_url
+            self.write_rows(property_data)
+            logging.info(f"Done scraping data for {property_title}.")
+        else:
+            logging.error(f"Problem in the property page for {property_title}")
+
+    def parse_listing_cards(self, soup):
+        properties = []
+        for available_property in soup.find_all('div', class_='properties-component col-sm-4'):
+            property_title_element = available_property.find('a')
+            if property_title_element is None or not property_title_element.get('href'):
+                continue
+            property_url = urljoin(base_url, property_title_element.get('href'))
+            self.card_fingerprints[property_url] = fingerprint(available_property.get_text(" ", strip=True))
+            properties.append((property_title_element.get('title'), property_url))
+        return properties
+
+    def find_load_more_endpoint(self, button):
+        # Only the button's own attributes: the endpoint is the one holding a URL, and its query string
+        # carries the parameter names the endpoint actually takes
+        endpoint = next(
+            (value for name, value in button.attrs.items()
+             if (name == 'href' or name.startswith('data-')) and isinstance(value, str)
+             and value.startswith(('/', 'http://', 'https://')) and value != '/'),
+            None,
+        )
+        if endpoint is None:
+            return None, None, None, None
+
+        parts = urlsplit(endpoint)
+        params = dict(parse_qsl(parts.query, keep_blank_values=True))
+        page_key = next((key for key in params if key.lower() in ('page', 'pagenumber', 'pageindex', 'pageno')), None)
+        if page_key is None:
+            # Without a page parameter there is nothing to page, so the browser does it instead
+            return None, None, None, None
+
+        # The button tracks the page it last loaded under the same name as the parameter
+        current = button.get('data-' + page_key.lower(), params[page_key])
+        page = int(current) + 1 if str(current).isdigit() else 2
+        return urlunsplit(parts._replace(query='')), params, page_key, page
+
+    def parse_load_more_response(self, response):
+        # Handles both an HTML fragment of cards and JSON carrying card HTML or property items
+        try:
+            payload = response.json()
+        except ValueError:
+            return self.parse_listing_cards(self.make_soup(response.content)), None
+
+        properties = []
+        values = [payload]
+        while values:
+            value = values.pop(0)
+            if isinstance(value, dict):
+                url = value.get('url') or value.get('Url') or value.get('link') or value.get('Link')
+                title = value.get('title') or value.get('Title') or value.get('name') or value.get('Name')
+                if isinstance(url, str) and isinstance(title, str):
+                    property_url = urljoin(base_url, url)
+                    self.card_fingerprints[property_url] = fingerprint(json.dumps(value, sort_keys=True, default=str))
+                    properties.append((title, property_url))
+                values.extend(value.values())
+            elif isinstance(value, list):
+                values.extend(value)
+            elif isinstance(value, str) and '<' in value:
+                properties.extend(self.parse_listing_cards(self.make_soup(value)))
+
+        # None when the payload does not say, so the caller stops once a page adds nothing new
+        has_more = None
+        if isinstance(payload, dict):
+            has_more = payload.get('hasMore', payload.get('HasMore', payload.get('moreResults')))
+        return properties, has_more
+
+    def load_listing_over_http(self, availability_url):
+        # Pages the endpoint behind "Load More" with plain requests, None when it cannot be used
+        response = self.make_request(availability_url)
+        if response.status_code != 200:
+            return None
+        soup = self.make_soup(response.content)
+        properties = self.parse_listing_cards(soup)
+
+        button = soup.find(class_='property-load-more-btn')
+        if button is None:
+            # Everything is already on the page, unless the cards themselves are rendered by script
+            return properties or None
+        endpoint, params, page_key, page = self.find_load_more_endpoint(button)
+        if endpoint is None:
+            return None
+
+        endpoint_url = urljoin(availability_url, endpoint)
+        seen = set(properties)
+        has_more = True
+        for _ in range(listing_max_pages):
+            params[page_key] = page
+            # Query string built into the URL so every page is recorded as its own fixture
+            page_url = endpoint_url + '?' + urlencode(params)
+            response = self.make_request(page_url)
+            if response.status_code != 200:
+                # A partial listing would read as removed properties, so the browser loads it instead
+                logging.warning(
+                    f"Load More page {page} of {availability_url} returned {response.status_code} "
+                    f"after {len(properties)} properties, falling back to Selenium"
+                )
+                return None
+            cards, has_more = self.parse_load_more_response(response)
+            new_cards = [card for card in cards if card not in seen]
+            if not new_cards:
+                break
+            seen.update(new_cards)
+            properties.extend(new_cards)
+            if has_more is False:
+                break
+            page += 1
+        else:
+            if has_more is not False:
+                logging.warning(
+                    f"Stopped paging {availability_url} after {listing_max_pages} pages with more still "
+                    f"available, falling back to Selenium"
+                )
+                return None
+
+        return properties
+
+    def load_listing(self, availability_url):
+        if listing_mode == "http":
+            try:
+                properties = self.load_listing_over_http(availability_url)
+            except (requests.RequestException, ValueError) as e:
+                logging.error(f"Error paging the listing of {availability_url}: {e}")
+                properties = None
+            if properties:
+                logging.info(f"Loaded {len(properties)} properties from {availability_url} without a browser")
+                return properties
+            logging.info(f"Load More endpoint not usable for {availability_url}, falling back to selenium")
+
+        return self.parse_listing_cards(self.make_soup(self.load_listing_page(availability_url)))
+
+    async def load_listings(self, availability_urls):
+        # Crawls every category at once and merges their cards into one de-duplicated queue of property pages,
+        # along with the categories that failed to load
+        semaphore = asyncio.Semaphore(category_concurrency)
+
+        async def load_one(availability_url):
+            async with semaphore:
+                return await asyncio.to_thread(self.load_listing, availability_url)
+
+        listings = await asyncio.gather(
+            *(load_one(availability_url) for availability_url in availability_urls), return_exceptions=True
+        )
+
+        properties = []
+        failed = []
+        seen = set()
+        for availability_url, listing in zip(availability_urls, listings):
+            if isinstance(listing, Exception):
+                logging.error(f"Failed to load listing {availability_url}: {listing!r}")
+                failed.append(availability_url)
+                continue
+            for property_title, property_url in listing:
+                if property_url not in seen:
+                    seen.add(property_url)
+                    properties.append((property_title, property_url))
+        return properties, failed
+
+    @timed("browser")
+    def load_listing_page(self, availability_url):
+        # Renders a category listing in Chrome, clicking "Load More" until every property is shown
+        if self.fixtures.replaying:
+            return self.fixtures.load_text(availability_url)
+
+        logging.info(f"Using selenium to while opening on the link: {availability_url}")
+        with self.get_driver_pool().driver() as driver:
+            driver.get(availability_url)
+            self.wait_for_page_to_load(driver)
+            # Define a while loop to click the "Load More" button until it's not found
+            while True:
+                try:
+                    # Find the "Load More" button element
+                    load_more_button = WebDriverWait(driver, 10).until(
+                        EC.presence_of_element_located((By.CLASS_NAME, "property-load-more-btn"))
+                    )
+                    # Click the "Load More" button
+                    load_more_button.click()
+                    # Wait for the page to load again
+                    self.wait_for_page_to_load(driver)
+                except:
+                    # If the "Load More" button is not found, exit the loop
+                    break
+            # Wait for the page to load again
+            self.wait_for_page_to_load(driver)
+
+            html_content = driver.page_source
+        self.fixtures.record_text(availability_url, html_content)
+        return html_content
+
     def scrape_main_page(self, base_url):
         
-        columns = ['scrape_datetime', 'data_url', 'Address', 'Level', 'Space options', 'Availability', 'Price from', 'Outgoings', 'Floor area', 'Fitout']
-        
-        df = pd.DataFrame(columns=columns)
-        
         main_page_url = base_url + "/leasing/office"
         main_page_response = self.make_request(main_page_url)
 
         if main_page_response.status_code == 200:
             logging.info("Successful request for the base URL.")
             
-            main_page_soup = BeautifulSoup(main_page_response.content, 'html.parser')
+            main_page_soup = self.make_soup(main_page_response.content)
             office_availabilities_li = main_page_soup.find_all('li', class_='nav-item active has-sub-menu')
             
             for availability in office_availabilities_li:
                 availability_div = availability.find('div', class_='collapse sub-menu')
                 
             availability_links = availability_div.find_all('span', class_='main-link-area')
+            availability_urls = [base_url + link['data-link'] for link in availability_links]
 
-            for link in availability_links:
-                data_link = link['data-link']
-                availability_url = base_url + data_link
-                logging.info(f"Using selenium to while opening on the link: {availability_url}")
-
-                self.load_driver()
-                self.driver.get(availability_url)
-                self.wait_for_page_to_load()
-                # Define a while loop to click the "Load More" button until it's not found
-                while True:
-                    try:
-                        # Find the "Load More" button element
-                        load_more_button = WebDriverWait(self.driver, 10).until(
-                            EC.presence_of_element_located((By.CLASS_NAME, "property-load-more-btn"))
-                        )
-                        # Click the "Load More" button
-                        load_more_button.click()
-                        # Wait for the page to load again
-                        self.wait_for_page_to_load()
-                    except:
-                        # If the "Load More" button is not found, exit the loop
-                        break
-                # Wait for the page to load again
-                self.wait_for_page_to_load()
-                
-                property_soup = self.get_soup(self.driver)
-                self.driver.close()
-                available_properties_div = property_soup.find_all('div', class_='properties-component col-sm-4')
-                for available_property in available_properties_div:
-                    property_title_element = available_property.find('a')
-                    property_href = property_title_element.get('href')
-                    property_title = property_title_element.get('title')
-                    property_url = base_url + property_href
-                    
-                    logging.info(f"Scraping data for {property_title}...")
-                    property_data = self.scrape_property_page(property_url)
-
-                    if not property_data.empty:
-                        property_data['scrape_datetime'] = scrape_datetime
-                        property_data['data_url'] = property_url
-                        df = pd.concat([df, property_data], ignore_index=True, axis = 0)
-                        logging.info(f"Done scraping data for {property_title}.")
-                    else:
-                        logging.error(f"Problem in the property page for {property_title}")
-
-            if not df.empty:
+            logging.info(f"Crawling {len(availability_urls)} categories concurrently...")
+            properties, failed = asyncio.run(self.load_listings(availability_urls))
+            if failed:
+                # A missing category would read as every one of its suites being removed, so the whole run is retried
+                logging.error(f"{len(failed)} of {len(availability_urls)} categories failed to load")
+                return False
+
+            logging.info(f"Fetching {len(properties)} property pages concurrently...")
+            asyncio.run(self.scrape_property_pages(properties, self.write_property))
+
+            if self.sink.rows_written:
                 logging.info("Done with scraping all data.")
-                self.MASTER_DF = df
                 success = True
                 
             else:
@@ -301,42 +646,65 @@ class Scraper:
        
         return success
 
+    def save_changes(self, filename):
+        # Suites added, removed or changed since the previous snapshot, next to the full output
+        changes = self.snapshot.diff([column for column in self.output_columns if column != 'scrape_datetime'])
+        changes.insert(1, 'scrape_datetime', scrape_datetime)
+        changes.to_csv(
+            filename,
+            encoding="utf-8",
+            quotechar='"',
+            quoting=csv.QUOTE_ALL,
+            index=False,
+        )
+        self.snapshot.save()
+        logging.info(f"{len(changes)} suite changes written to {filename}")
+
     @retry
     def start_scraper(self, historical) -> list:
         self.historical = historical
+        if self.sink is not None:
+            self.sink.open()
+        if change_detection:
+            self.snapshot = PropertySnapshot(snapshot_filename)
         page_url = f"{base_url}"
         success = self.scrape_data(page_url)
 
         if not success:
-            self.MASTER_DF = pd.DataFrame()
             logging.error("SCRAPER FAILED. RETRYING...")
 
         return success
 
 def run(filename: str):
     scraper = Scraper()
-    success = scraper.start_scraper(historical=False)
+    try:
+        scraper.sink = make_sink(filename, scraper.output_columns)
+    except ValueError as e:
+        logging.info(f"{e} OUTPUT FILE NOT GENERATED.")
+        return
+
+    try:
+        success = scraper.start_scraper(historical=False)
+    finally:
+        scraper.close_session()
+        scraper.close_driver_pool()
+        scraper.sink.close()
+        logging.info("STAGE TIMINGS\n" + scraper.timer.summary(scraper.sink.rows_written))
+        scraper.timer.save(os.path.splitext(filename)[0] + "-timings.json", scraper.sink.rows_written)
 
     if not success:
-        logging.error("FINAL ATTEMPT FAILED. EXITING...")
+        logging.error(f"FINAL ATTEMPT FAILED. PARTIAL OUTPUT KEPT IN {scraper.sink.temp_filename}. EXITING...")
         return
 
-    outputs = scraper.MASTER_DF
-    
-    if not outputs.empty:
-        if outputs.columns[0] == "scrape_datetime":
-            logging.info("GENERATING FINAL OUTPUT...")
-            outputs.to_csv(
-                filename,
-                encoding="utf-8",
-                quotechar='"',
-                quoting=csv.QUOTE_ALL,
-                index=False,
-            )
-        else:
-            logging.info(
-                'MISSING "scrape_datetime" COLUMN OR IT IS NOT THE FIRST COLUMN. CSV FILE NOT GENERATED.'
-            )
+    if scraper.sink.rows_written:
+        logging.info("GENERATING FINAL OUTPUT...")
+        scraper.sink.finalize()
+        if scraper.snapshot is not None:
+            scraper.save_changes(os.path.splitext(filename)[0] + "-changes.csv")
+    else:
+        os.remove(scraper.sink.temp_filename)
+        logging.error("No data scraped ...")
+
 
 if __name__ == "__main__":
     run(filename=output_filename)
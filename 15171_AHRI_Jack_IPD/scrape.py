@@ -1,5 +1,5 @@
 import os
-import csv
+import sys
 import time
 import shutil
 import random
@@ -7,10 +7,16 @@ import pikepdf
 import logging
 import requests
 import calendar
-import pandas as pd
 from io import BytesIO
 from datetime import datetime
-from bs4 import BeautifulSoup
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import scraper_common
+from scraper_common import (
+    timed, RateLimiter, ResponseCache, StageTimer, FixtureStore, RetryPolicy, BaseScraper,
+    resolve_excel_engine, resolve_html_parser,
+)
 
 
 base_url = "https://www.ahrinet.org/analytics/statistics/monthly-shipments"
@@ -19,10 +25,38 @@ output_filename = (
     job_name.split("using")[0].strip().lower().replace(" ", "-") + "-sample.csv"
 )
 scrape_datetime = datetime.utcnow()
+output_format = os.environ.get("OUTPUT_FORMAT", "csv")  # csv, parquet or arrow
+parquet_compression = "zstd"
 proxy_address = os.environ.get("HTTP_PROXY")
+pool_connections = 4  # Number of hosts kept in the connection pool
+pool_maxsize = 10  # Keep-alive connections kept per host
+rate_limits = {
+    # host: requests per second, burst size, max extra jitter in seconds
+    "www.ahrinet.org": {"rate": 0.5, "burst": 2, "jitter": 0.5},
+}
+default_rate_limit = {"rate": 0.5, "burst": 1, "jitter": 0.5}
+retry_statuses = {429, 500, 502, 503, 504}  # Responses worth retrying a single request for
+retry_backoff_base = 2  # Seconds before the first retry, doubled on every attempt
+retry_backoff_max = 60  # Upper bound for a single backoff in seconds
+retry_after_max = 300  # Longest Retry-After honoured, asking for more gives up on the request
+retry_budget = 20  # Request retries allowed across a whole run
+http_mode = os.environ.get("HTTP_MODE", "live")  # live, record or replay
+html_parser = os.environ.get("HTML_PARSER", "lxml")  # BeautifulSoup backend, html.parser is the fallback
+fixtures_dir = os.path.abspath("fixtures")  # Where record mode saves responses and replay mode reads them
+output_schema = {
+    # column: (type, format used to parse it) for parquet/arrow output
+    "scrape_datetime": ("timestamp", None),
+    "Month_to_Date_Units": ("int", None),
+    "Product_Type": ("string", None),
+    "month": ("date", "%Y/%m/%d"),
+}
+cache_dir = os.path.abspath("http_cache")  # Conditional-GET cache for downloaded artifacts
+cache_max_bytes = 500 * 1024 * 1024  # Least recently used files are evicted past this size
+excel_engine = os.environ.get("EXCEL_ENGINE", "calamine")  # Rust-backed calamine, or a pandas engine such as openpyxl
+excel_columns = ['Product_Type', 'Month_to_Date_Units']  # Only columns kept from the monthly workbooks
 
 def retry(RETRY_START_SCRAPER):
-    RETRIES = 5
+    RETRIES = 2  # Last resort only, single requests are retried in make_request
     reattempt_delay_time = int(1.5 * 60)  # In seconds -> Actual delay will be +-20 sec
 
     def wrapper(self, *args, **kwargs):
@@ -48,16 +82,30 @@ def retry(RETRY_START_SCRAPER):
 
     return wrapper
 
-class Scraper:
+
+def make_sink(filename, columns):
+    return scraper_common.make_sink(
+        filename, columns, output_format, output_schema, parquet_compression
+    )
+
+
+class Scraper(BaseScraper):
     def __init__(self):
-        self.MASTER_DF = pd.DataFrame()
+        super().__init__(pool_connections, pool_maxsize)
+        self.sink = None
+        self.rate_limiter = RateLimiter(rate_limits, default_rate_limit)
+        self.retry_policy = RetryPolicy(retry_statuses, retry_backoff_base, retry_backoff_max, retry_after_max, retry_budget)
+        self.timer = StageTimer(job_name, scrape_datetime)
+        self.html_parser = resolve_html_parser(html_parser)
+        self.fixtures = FixtureStore(fixtures_dir, http_mode)
+        self.cache = ResponseCache(cache_dir, cache_max_bytes)
+        self.excel_engine = resolve_excel_engine(excel_engine)
         
         self.historical = None
         self.my_dir = None
         
-        # Creating an empty DataFrame with specified column names
+        # Column layout of the output file
         self.output_columns = ['scrape_datetime', 'Month_to_Date_Units', 'Product_Type', 'month']
-        self.output = pd.DataFrame(columns=self.output_columns)
         
         self.DEBUG = False
         if self.DEBUG:
@@ -96,7 +144,7 @@ class Scraper:
             s.params.update(params)
         
         return s
-    
+
     def create_dir(self):
 
         temp = "resources"
@@ -119,6 +167,7 @@ class Scraper:
             logging.info(f'{self.my_dir} do not exists...')
     # endregion 
 
+    @timed("pdf_parse")
     def extract_excel_link_from_pdf(self, pdf_content):
         try:
             excel_link = ''
@@ -153,12 +202,13 @@ class Scraper:
             os.remove("temp_pdf.pdf")
             return excel_link
     
+    @timed("transform")
     def read_excel(self, df, month, year):
         
         try:
             
             df_excel = df
-            df_excel = df_excel[['Product_Type', 'Month_to_Date_Units']]
+            df_excel = df_excel[excel_columns]
             
             month_number = datetime.strptime(month, '%B').month
             year = int(year)
@@ -182,9 +232,8 @@ class Scraper:
         logging.info(f"PROCESSING PAGE: {base_url}")
         success = True
         try:
-            session = self.make_session()
-            response = session.get(base_url)
-            soup = BeautifulSoup(response.content, 'html.parser')
+            response = self.make_request(base_url)
+            soup = self.make_soup(response.content)
             
             tables = soup.find_all('table')
             for table in tables:
@@ -202,7 +251,7 @@ class Scraper:
                             month_link = "https://www.ahrinet.org" + month_link
                         
                         if month_link.endswith('.pdf'):
-                            monthly_link_response = session.get(month_link)
+                            monthly_link_response = self.make_request(month_link, cache=True)
                             if monthly_link_response.status_code == 200:
                                 logging.info(f"Sucessful request to download PDF from {month_link} ...")
                                 pdf_content = monthly_link_response.content
@@ -210,23 +259,27 @@ class Scraper:
                                 if not excel_link:
                                     logging.error(f"Something went wrong while getting excel_link from pdf for {month}, {year} ...")
                                     continue
-                                excel_link_response = session.get(excel_link)
+                                excel_link_response = self.make_request(excel_link, cache=True)
                                 if excel_link_response.status_code == 200:
                                     logging.info(f"Sucessful request to download excel for {month} ...")
                                     # Read the content of the response (Excel file) into a BytesIO object
                                     excel_data = BytesIO(excel_link_response.content)
                                     
                                     # Read Excel file from BytesIO object into a DataFrame
-                                    df = pd.read_excel(excel_data)
+                                    df = self.load_excel(excel_data, usecols=lambda column: column in excel_columns)
                                     data = self.read_excel(df, month, year)
+                                else:
+                                    logging.error(f"Skipping {month}, {year}: excel download failed ...")
+                                    continue
                             else:
                                 logging.error(f"Something wrong with the request for {month_link} ...")
+                                continue
                             
                         else:
-                            monthly_link_response = session.get(month_link)
+                            monthly_link_response = self.make_request(month_link)
                             if monthly_link_response.status_code == 200:
                                 logging.info(f"Sucessful request to {month_link} ...")
-                                monthly_link_soup = BeautifulSoup(monthly_link_response.content, 'html.parser')
+                                monthly_link_soup = self.make_soup(monthly_link_response.content)
                                 div = monthly_link_soup.find('div', class_='coh-container coh-wysiwyg')
                                 links = div.find_all('a')
                                 desire_link = links[-1]
@@ -237,29 +290,30 @@ class Scraper:
                                 if "www.ahrinet.org" not in excel_link:
                                     excel_link = "https://www.ahrinet.org" + excel_link
                                 
-                                excel_link_response = session.get(excel_link)
+                                excel_link_response = self.make_request(excel_link, cache=True)
                                 if excel_link_response.status_code == 200:
                                     logging.info(f"Sucessful request to download excel for {month} ...")
                                     # Read the content of the response (Excel file) into a BytesIO object
                                     excel_data = BytesIO(excel_link_response.content)
                                     
                                     # Read Excel file from BytesIO object into a DataFrame
-                                    df = pd.read_excel(excel_data)
-                                    data = self.read_excel(excel_data, month, year)
+                                    df = self.load_excel(excel_data, usecols=lambda column: column in excel_columns)
+                                    data = self.read_excel(df, month, year)
+                                else:
+                                    logging.error(f"Skipping {month}, {year}: excel download failed ...")
+                                    continue
                                 
                             else:
                                 logging.error(f"Something wrong with the request for {month_link} ...")
+                                continue
                             
-                        self.output = pd.concat([self.output, data], axis = 0, ignore_index=True)
-                        self.output = self.output.reset_index(drop=True)
+                        self.write_rows(data)
                         logging.info(f"Done scrapping for Year: {year}, Month: {month}")
-                        self.MASTER_DF = self.output
                         
                         if not self.historical:
                             return success
                         
             logging.info(f"All the data got scrape till {month}, {year}")
-            self.MASTER_DF = self.output
             success = True
         except:
             logging.error("Issue with scraping ...")
@@ -272,12 +326,12 @@ class Scraper:
     @retry
     def start_scraper(self, historical) -> list:
         self.historical = historical
+        if self.sink is not None:
+            self.sink.open()
         page_url = f"{base_url}"
         success = self.scrape_data(page_url)
 
         if not success:
-            self.MASTER_DF = pd.DataFrame()
-            
             logging.error("SCRAPER FAILED. RETRYING...")
 
         return success
@@ -287,29 +341,29 @@ class Scraper:
 
 def run(filename: str):
     scraper = Scraper()
-    success = scraper.start_scraper(historical=False)
+    try:
+        scraper.sink = make_sink(filename, scraper.output_columns)
+    except ValueError as e:
+        logging.info(f"{e} OUTPUT FILE NOT GENERATED.")
+        return
+
+    try:
+        success = scraper.start_scraper(historical=False)
+    finally:
+        scraper.close_session()
+        scraper.sink.close()
+        logging.info("STAGE TIMINGS\n" + scraper.timer.summary(scraper.sink.rows_written))
+        scraper.timer.save(os.path.splitext(filename)[0] + "-timings.json", scraper.sink.rows_written)
 
     if not success:
-        logging.error("FINAL ATTEMPT FAILED. EXITING...")
+        logging.error(f"FINAL ATTEMPT FAILED. PARTIAL OUTPUT KEPT IN {scraper.sink.temp_filename}. EXITING...")
         return
 
-    outputs = scraper.MASTER_DF
-    
-    if not outputs.empty:
-        if outputs.columns[0] == "scrape_datetime":
-            logging.info("GENERATING FINAL OUTPUT...")
-            outputs.to_csv(
-                filename,
-                encoding="utf-8",
-                quotechar='"',
-                quoting=csv.QUOTE_ALL,
-                index=False,
-            )
-        else:
-            logging.info(
-                'MISSING "scrape_datetime" COLUMN OR IT IS NOT THE FIRST COLUMN. CSV FILE NOT GENERATED.'
-            )
+    if scraper.sink.rows_written:
+        logging.info("GENERATING FINAL OUTPUT...")
+        scraper.sink.finalize()
     else:
+        os.remove(scraper.sink.temp_filename)
         logging.error("No data scraped ...")
 
 
@@ -1,14 +1,34 @@
 import os
+import sys
 import time
-import csv
 import shutil
 import random
 import logging
+import hashlib
+import json
+import threading
+import sqlite3
+import asyncio
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 import requests
 import pandas as pd
-from bs4 import BeautifulSoup
+from bs4 import SoupStrainer
 from datetime import datetime, timedelta
 
+try:
+    from pypdf import PdfReader
+except ImportError:  # Only needed to extract announcement text from PDFs
+    PdfReader = None
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import scraper_common
+from scraper_common import (
+    timed, RateLimiter, StageTimer, FixtureStore, CsvSink, RetryPolicy, BaseScraper,
+    resolve_html_parser,
+)
+
 
 base_url = "https://www1.hkexnews.hk/search/titlesearch.xhtml"
 job_name = "15206_HKEX_David_IPD Scrape using requests"
@@ -16,7 +36,45 @@ output_filename = (
     job_name.split("using")[0].strip().lower().replace(" ", "-") + "-sample.csv"
 )
 scrape_datetime = datetime.utcnow()
+output_format = os.environ.get("OUTPUT_FORMAT", "csv")  # csv, parquet or arrow
+parquet_compression = "zstd"
 proxy_address = os.environ.get("HTTP_PROXY")
+pool_connections = 4  # Number of hosts kept in the connection pool
+pool_maxsize = 10  # Keep-alive connections kept per host
+rate_limits = {
+    # host: requests per second, burst size, max extra jitter in seconds
+    "www1.hkexnews.hk": {"rate": 1.0, "burst": 2, "jitter": 0.5},
+}
+default_rate_limit = {"rate": 0.5, "burst": 1, "jitter": 0.5}
+retry_statuses = {429, 500, 502, 503, 504}  # Responses worth retrying a single request for
+retry_backoff_base = 2  # Seconds before the first retry, doubled on every attempt
+retry_backoff_max = 60  # Upper bound for a single backoff in seconds
+retry_after_max = 300  # Longest Retry-After honoured, asking for more gives up on the request
+retry_budget = 20  # Request retries allowed across a whole run
+http_mode = os.environ.get("HTTP_MODE", "live")  # live, record or replay
+html_parser = os.environ.get("HTML_PARSER", "lxml")  # BeautifulSoup backend, html.parser is the fallback
+fixtures_dir = os.path.abspath("fixtures")  # Where record mode saves responses and replay mode reads them
+keywords = [
+    # Title keywords searched in one run, comma separated in HKEX_KEYWORDS
+    keyword.strip() for keyword in os.environ.get("HKEX_KEYWORDS", "CSRC").split(",") if keyword.strip()
+]
+backfill_from = os.environ.get("BACKFILL_FROM")  # YYYYMMDD, searches the last 30 days when unset
+backfill_to = os.environ.get("BACKFILL_TO")  # YYYYMMDD, defaults to today
+window_days = 31  # Days covered by one search before any splitting, the default range is 31 days inclusive
+search_result_cap = 100  # Rows the site returns for one search, a full page means the window is split
+window_concurrency = 4  # Keyword and date window searches run at the same time
+pdf_text_enabled = os.environ.get("PDF_TEXT", "0") == "1"  # Fill news_text from the linked announcement PDFs
+pdf_cache_dir = os.path.abspath("pdf_cache")  # Extracted text keyed by PDF content hash, kept across runs
+pdf_concurrency = 4  # PDFs downloaded at the same time
+pdf_workers = os.cpu_count() or 2  # Processes extracting PDF text
+pdf_chunk_size = 64 * 1024  # Bytes streamed to disk per chunk
+poll_interval = int(os.environ.get("POLL_INTERVAL", "0"))  # Seconds between polls, 0 scrapes once and exits
+seen_index_filename = "seen_news.sqlite"  # news_id of every announcement polling has already emitted
+output_schema = {
+    # column: (type, format used to parse it) for parquet/arrow output, other columns are strings
+    "news_date_time": ("timestamp", "%d/%m/%Y %H:%M"),
+    "scrape_datetime": ("timestamp", None),
+}
 
 headers = {
     'authority': 'www1.hkexnews.hk',
@@ -42,8 +100,13 @@ params = {
     'lang': 'en',
 }
 
+# Only the result rows and the searched keyword are built into the tree, not the page chrome
+search_results_only = SoupStrainer(
+    lambda name, attrs: name == 'tbody' or (name == 'input' and attrs.get('id') == 'newsTitle')
+)
+
 def retry(RETRY_START_SCRAPER):
-    RETRIES = 5
+    RETRIES = 2  # Last resort only, single requests are retried in make_request
     reattempt_delay_time = int(1.5 * 60)
 
     def wrapper(self, *args, **kwargs):
@@ -70,10 +133,117 @@ def retry(RETRY_START_SCRAPER):
     return wrapper
 
 
-class Scraper:
+def extract_pdf_text(path):
+    # Runs in a worker process, so it only takes and returns plain values
+    reader = PdfReader(path)
+    return "\n".join((page.extract_text() or "").strip() for page in reader.pages).strip()
+
+
+class PdfTextCache:
+    # Extracted text stored once per PDF content hash, with the hash each announcement link resolved to
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def text_path(self, digest):
+        return os.path.join(self.cache_dir, digest + ".txt")
+
+    def read(self, digest):
+        try:
+            with open(self.text_path(digest), encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def lookup(self, url):
+        digest = self.index.get(url)
+        return self.read(digest) if digest is not None else None
+
+    def update(self, url, digest, text):
+        with self.lock:
+            if not os.path.exists(self.text_path(digest)):
+                with open(self.text_path(digest), "w", encoding="utf-8") as f:
+                    f.write(text)
+            self.index[url] = digest
+
+    def save_index(self):
+        with self.lock:
+            temp_path = self.index_path + ".part"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(self.index, f)
+            os.replace(temp_path, self.index_path)
+
+
+class SeenNewsIndex:
+    # Announcements already emitted by polling, with their release time as the next poll's starting point
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS seen_news (news_id TEXT PRIMARY KEY, news_date_time TEXT NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS seen_news_date_time ON seen_news (news_date_time)"
+            )
+
+    def filter_new(self, rows):
+        if not rows:
+            return rows
+        news_ids = [row['news_id'] for row in rows]
+        placeholders = ",".join("?" * len(news_ids))
+        seen = {
+            news_id for (news_id,) in self.connection.execute(
+                f"SELECT news_id FROM seen_news WHERE news_id IN ({placeholders})", news_ids
+            )
+        }
+        return [row for row in rows if row['news_id'] not in seen]
+
+    def add(self, rows):
+        # Release times are stored as ISO strings so MAX() gives the latest one
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO seen_news VALUES (?, ?)",
+                [
+                    (row['news_id'], datetime.strptime(row['news_date_time'], '%d/%m/%Y %H:%M').isoformat())
+                    for row in rows
+                ],
+            )
+
+    def watermark(self):
+        (latest,) = self.connection.execute("SELECT MAX(news_date_time) FROM seen_news").fetchone()
+        return datetime.fromisoformat(latest) if latest else None
+
+    def close(self):
+        self.connection.close()
+
+
+def make_sink(filename, columns):
+    return scraper_common.make_sink(
+        filename, columns, output_format, output_schema, parquet_compression, datetime_column=-1
+    )
+
+
+class Scraper(BaseScraper):
     def __init__(self):
         
-        self.MASTER_DF = pd.DataFrame()
+        self.output_columns = ['keyword', 'stock_code', 'stock_name', 'news_id', 'news_date_time',
+                               'news_link', 'news_title', 'news_text', 'scrape_datetime']
+        super().__init__(pool_connections, pool_maxsize, headers, params)
+        self.sink = None
+        self.rate_limiter = RateLimiter(rate_limits, default_rate_limit)
+        self.retry_policy = RetryPolicy(retry_statuses, retry_backoff_base, retry_backoff_max, retry_after_max, retry_budget)
+        self.timer = StageTimer(job_name, scrape_datetime)
+        self.html_parser = resolve_html_parser(html_parser)
+        self.fixtures = FixtureStore(fixtures_dir, http_mode)
+        self.pdf_cache = PdfTextCache(pdf_cache_dir) if pdf_text_enabled else None
+        self.seen = None
         self.historical = None
         self.my_dir = None
 
@@ -112,7 +282,7 @@ class Scraper:
             s.params.update(params)
         
         return s
-    
+
     def create_dir(self):
 
         temp = "resources"
@@ -128,7 +298,7 @@ class Scraper:
 
     def remove_dir(self):
 
-        if os.path.isdir(self.my_dir):
+        if self.my_dir is not None and os.path.isdir(self.my_dir):
             shutil.rmtree(self.my_dir)
             logging.info(f'{self.my_dir} removed successfully.')
         else:
@@ -136,10 +306,209 @@ class Scraper:
     
     def date_range(self):
         today = datetime.now().date()
+        if backfill_from:
+            from_date = datetime.strptime(backfill_from, '%Y%m%d').date()
+            to_date = datetime.strptime(backfill_to, '%Y%m%d').date() if backfill_to else today
+            return from_date, to_date
         one_month_ago = today - timedelta(days=30)
 
         return one_month_ago, today
 
+    def date_windows(self, from_date, to_date, days=window_days):
+        windows = []
+        start = from_date
+        while start <= to_date:
+            end = min(start + timedelta(days=days - 1), to_date)
+            windows.append((start, end))
+            start = end + timedelta(days=1)
+        return windows
+
+    def search_window(self, title, from_date, to_date):
+        data = {
+            'lang': 'EN',
+            'category': '0',
+            'market': 'SEHK',
+            'searchType': '0',
+            'documentType': '-1',
+            't1code': '-2',
+            't2Gcode': '-2',
+            't2code': '-2',
+            'stockId': '-1',
+            'from': from_date.strftime('%Y%m%d'),
+            'to': to_date.strftime('%Y%m%d'),
+            'MB-Daterange': '0',
+            'title': title,
+        }
+
+        response = self.make_request(base_url, method="POST", data=data)
+        soup = self.make_soup(response.content, parse_only=search_results_only)
+        rows = self.parse_search_results(soup)
+        for row in rows:
+            row['keyword'] = row['keyword'] or title
+
+        # A full page may have cut off older results, so search each half of the window instead
+        if len(rows) >= search_result_cap:
+            if from_date < to_date:
+                middle = from_date + (to_date - from_date) // 2
+                logging.info(f"{len(rows)} results from {from_date} to {to_date}, splitting the window")
+                return (
+                    self.search_window(title, from_date, middle)
+                    + self.search_window(title, middle + timedelta(days=1), to_date)
+                )
+            logging.warning(f"{len(rows)} results on {from_date}, some may be missing")
+        return rows
+
+    async def search_windows(self, searches):
+        # Bounded parallel (keyword, from, to) searches over the one pooled session, results come back in order
+        semaphore = asyncio.Semaphore(window_concurrency)
+
+        async def search_one(title, from_date, to_date):
+            async with semaphore:
+                return await asyncio.to_thread(self.search_window, title, from_date, to_date)
+
+        results = await asyncio.gather(*(search_one(*search) for search in searches))
+        return [row for rows in results for row in rows]
+
+    def dedupe_results(self, rows):
+        # One row per announcement, carrying every keyword that matched it
+        unique = {}
+        for row in rows:
+            if row['news_id'] not in unique:
+                unique[row['news_id']] = dict(row, keyword=[row['keyword']])
+            elif row['keyword'] not in unique[row['news_id']]['keyword']:
+                unique[row['news_id']]['keyword'].append(row['keyword'])
+        for row in unique.values():
+            row['keyword'] = "; ".join(row['keyword'])
+        return sorted(
+            unique.values(),
+            key=lambda row: datetime.strptime(row['news_date_time'], '%d/%m/%Y %H:%M'),
+            reverse=True,
+        )
+
+
+    @timed("transform")
+    def parse_search_results(self, soup):
+        data = []
+        
+        keyword_input = soup.find('input', {'id': 'newsTitle'})
+        keyword = keyword_input.get('value') if keyword_input is not None else None
+        table_body = soup.find('tbody')
+        if table_body is None:  # No announcements in the searched range
+            return data
+        rows = table_body.find_all('tr')
+        
+        for row in rows:
+            stock_code = row.find('td', {'class': 'stock-short-code'}).get_text().strip().split('Stock Code: ')[1]
+            stock_name = row.find('td', {'class': 'stock-short-name'}).get_text().strip().split('Stock Short Name: ')[1]
+            news_id = row.find('a').get('href').split('/')[-1].split('.')[0]
+            news_date_time = row.find('td', {'class': 'release-time'}).get_text().strip().split('Release Time: ')[1]
+            news_link = 'https://www1.hkexnews.hk' + row.find('a').get('href')
+            headline = row.find('div', {'class': 'headline'}).get_text().strip()
+            text = row.find('a').get_text().strip()
+            news_title = headline + " " + text
+            news_text = news_title
+            scrape_time = scrape_datetime  
+        
+            data.append({
+                'keyword': keyword,
+                'stock_code': stock_code,
+                'stock_name': stock_name,
+                'news_id': news_id,
+                'news_date_time': news_date_time,
+                'news_link': news_link,
+                'news_title': news_title,
+                'news_text': news_text,
+                'scrape_datetime': scrape_time
+            })
+        
+        return data
+
+    def download_pdf(self, url):
+        # Streams the PDF to a temporary file chunk by chunk, hashing it on the way
+        response = self.make_request(url, stream=True)
+        if response.status_code != 200:
+            response.close()
+            raise requests.RequestException(f"status code {response.status_code} for {url}")
+
+        digest = hashlib.sha256()
+        fd, path = tempfile.mkstemp(suffix=".pdf", dir=self.my_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in response.iter_content(chunk_size=pdf_chunk_size):
+                    f.write(chunk)
+                    digest.update(chunk)
+        except Exception:
+            os.remove(path)
+            raise
+        finally:
+            response.close()
+        return path, digest.hexdigest()
+
+    async def fill_pdf_texts(self, rows):
+        # Downloads run in threads, text extraction in a process pool, the cache skips PDFs already seen
+        semaphore = asyncio.Semaphore(pdf_concurrency)
+        loop = asyncio.get_running_loop()
+
+        with ProcessPoolExecutor(max_workers=pdf_workers) as pool:
+            async def fill_one(row):
+                url = row['news_link']
+                if not url.lower().endswith('.pdf'):
+                    return
+                text = self.pdf_cache.lookup(url)
+                if text is None:
+                    async with semaphore:
+                        try:
+                            path, digest = await asyncio.to_thread(self.download_pdf, url)
+                        except requests.RequestException as e:
+                            logging.error(f"Error downloading {url}: {e}")
+                            return
+                    try:
+                        text = self.pdf_cache.read(digest)
+                        if text is None:
+                            text = await loop.run_in_executor(pool, extract_pdf_text, path)
+                    except Exception as e:
+                        logging.error(f"Error extracting text from {url}: {e}")
+                        return
+                    finally:
+                        os.remove(path)
+                    self.pdf_cache.update(url, digest, text)
+                if text:
+                    row['news_text'] = text
+
+            await asyncio.gather(*(fill_one(row) for row in rows))
+        self.pdf_cache.save_index()
+
+    def add_pdf_texts(self, data):
+        if PdfReader is None:
+            logging.error("pypdf IS REQUIRED TO EXTRACT PDF TEXT, KEEPING TITLES AS news_text.")
+            return
+        self.my_dir = self.create_dir()
+        with self.timer.stage("pdf_text"):
+            asyncio.run(self.fill_pdf_texts(data))
+        self.remove_dir()
+
+    def poll_once(self):
+        # Searches only from the day of the latest release already seen, so a quiet poll is one small request per keyword
+        today = datetime.now().date()
+        watermark = self.seen.watermark()
+        from_date = watermark.date() if watermark is not None else today - timedelta(days=1)
+        searches = [(keyword, from_date, today) for keyword in keywords]
+
+        data = self.dedupe_results(asyncio.run(self.search_windows(searches)))
+        data = self.seen.filter_new(data)
+        if not data:
+            return 0
+
+        poll_datetime = datetime.utcnow()
+        for row in data:
+            row['scrape_datetime'] = poll_datetime
+        if pdf_text_enabled:
+            self.add_pdf_texts(data)
+
+        # Marked as seen only once written, so a crash re-emits rows rather than losing them
+        self.write_rows(pd.DataFrame(data))
+        self.seen.add(data)
+        return len(data)
 
     def scrape_data(self, base_url: str) -> bool:
         logging.info(f"PROCESSING PAGE: {base_url}")
@@ -147,60 +516,18 @@ class Scraper:
         success = True
         try:
             from_date, to_date = self.date_range()
-            title = "CSRC"
-            
-            session = self.make_session(headers, params = params)
-        
-            data = {
-                'lang': 'EN',
-                'category': '0',
-                'market': 'SEHK',
-                'searchType': '0',
-                'documentType': '-1',
-                't1code': '-2',
-                't2Gcode': '-2',
-                't2code': '-2',
-                'stockId': '-1',
-                'from': from_date.strftime('%Y%m%d'),
-                'to': to_date.strftime('%Y%m%d'),
-                'MB-Daterange': '0',
-                'title': title,
-            }
-            
-            response = session.post(base_url, data=data)
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            data = []
-            
-            table_body = soup.find('tbody')
-            rows = table_body.find_all('tr')
-            
-            for row in rows:
-                keyword = soup.find('input', {'id': 'newsTitle'}).get('value')
-                stock_code = row.find('td', {'class': 'stock-short-code'}).get_text().strip().split('Stock Code: ')[1]
-                stock_name = row.find('td', {'class': 'stock-short-name'}).get_text().strip().split('Stock Short Name: ')[1]
-                news_id = row.find('a').get('href').split('/')[-1].split('.')[0]
-                news_date_time = row.find('td', {'class': 'release-time'}).get_text().strip().split('Release Time: ')[1]
-                news_link = 'https://www1.hkexnews.hk' + row.find('a').get('href')
-                headline = row.find('div', {'class': 'headline'}).get_text().strip()
-                text = row.find('a').get_text().strip()
-                news_title = headline + " " + text
-                news_text = news_title
-                scrape_time = scrape_datetime  
+            windows = self.date_windows(from_date, to_date)
+            searches = [(keyword, start, end) for keyword in keywords for start, end in windows]
+            logging.info(
+                f"SEARCHING {len(keywords)} KEYWORDS FROM {from_date} TO {to_date} IN {len(searches)} SEARCHES"
+            )
+            data = asyncio.run(self.search_windows(searches))
+            data = self.dedupe_results(data)
             
-                data.append({
-                    'keyword': keyword,
-                    'stock_code': stock_code,
-                    'stock_name': stock_name,
-                    'news_id': news_id,
-                    'news_date_time': news_date_time,
-                    'news_link': news_link,
-                    'news_title': news_title,
-                    'news_text': news_text,
-                    'scrape_datetime': scrape_time
-                })
+            if pdf_text_enabled:
+                self.add_pdf_texts(data)
             
-            self.MASTER_DF = pd.DataFrame(data)
+            self.write_rows(pd.DataFrame(data))
             
         except:
             success = False
@@ -210,11 +537,12 @@ class Scraper:
     @retry
     def start_scraper(self, historical) -> list:
         self.historical = historical
+        if self.sink is not None:
+            self.sink.open()
         page_url = f"{base_url}"
         success = self.scrape_data(page_url)
 
         if not success:
-            self.MASTER_DF = pd.DataFrame()
             self.remove_dir()
             logging.error("SCRAPER FAILED. RETRYING...")
 
@@ -222,33 +550,68 @@ class Scraper:
 
 def run(filename: str):
     scraper = Scraper()
-    success = scraper.start_scraper(historical=False)
+    try:
+        scraper.sink = make_sink(filename, scraper.output_columns)
+    except ValueError as e:
+        logging.info(f"{e} OUTPUT FILE NOT GENERATED.")
+        return
+
+    try:
+        success = scraper.start_scraper(historical=False)
+    finally:
+        scraper.close_session()
+        scraper.sink.close()
+        logging.info("STAGE TIMINGS\n" + scraper.timer.summary(scraper.sink.rows_written))
+        scraper.timer.save(os.path.splitext(filename)[0] + "-timings.json", scraper.sink.rows_written)
 
     if not success:
-        logging.error("FINAL ATTEMPT FAILED. EXITING...")
+        logging.error(f"FINAL ATTEMPT FAILED. PARTIAL OUTPUT KEPT IN {scraper.sink.temp_filename}. EXITING...")
         return
 
-    outputs = scraper.MASTER_DF
-    
-    if not outputs.empty:
-        if outputs.columns[-1] == "scrape_datetime":
-            logging.info("GENERATING FINAL OUTPUT...")
-            outputs.to_csv(
-                filename,
-                encoding="utf-8",
-                quotechar='"',
-                quoting=csv.QUOTE_ALL,
-                index=False,
-            )
-        else:
-            logging.info(
-                'MISSING "scrape_datetime" COLUMN OR IT IS NOT THE FIRST COLUMN. CSV FILE NOT GENERATED.'
-            )
+    if scraper.sink.rows_written:
+        logging.info("GENERATING FINAL OUTPUT...")
+        scraper.sink.finalize()
     else:
+        os.remove(scraper.sink.temp_filename)
         logging.error("No data scraped ...")
 
 
+def poll(filename: str, interval: int = poll_interval):
+    if output_format != "csv":
+        logging.info("POLLING APPENDS TO CSV ONLY. OUTPUT FILE NOT GENERATED.")
+        return
+    scraper = Scraper()
+    try:
+        scraper.sink = CsvSink(filename, scraper.output_columns, datetime_column=-1)
+    except ValueError as e:
+        logging.info(f"{e} OUTPUT FILE NOT GENERATED.")
+        return
+
+    scraper.seen = SeenNewsIndex(seen_index_filename)
+    scraper.sink.open_append()
+    logging.info(f"POLLING EVERY {interval} SECONDS, APPENDING TO {filename}")
+    try:
+        while True:
+            try:
+                new_rows = scraper.poll_once()
+                if new_rows:
+                    logging.info(f"{new_rows} NEW ANNOUNCEMENTS WRITTEN")
+            except Exception as e:
+                # A long-running poller logs a failed poll and keeps going, only Ctrl+C stops it
+                logging.exception(f"Poll failed: {e}")
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        logging.info("POLLING STOPPED")
+    finally:
+        scraper.close_session()
+        scraper.sink.close()
+        scraper.seen.close()
+
+
 if __name__ == "__main__":
-    run(filename=output_filename)
+    if poll_interval:
+        poll(filename=output_filename)
+    else:
+        run(filename=output_filename)
     logging.info("ALL DONE")
 
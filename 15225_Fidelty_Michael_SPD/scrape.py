@@ -1,12 +1,19 @@
 import os
+import sys
+import re
+import html
 import time
-import csv
 import shutil
 import random
 import logging
+import json
+import threading
+import asyncio
+import sqlite3
 import requests
 import pandas as pd
 from io import BytesIO
+from urllib.parse import urljoin
 from datetime import datetime
 
 
@@ -15,16 +22,83 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Only needed for parquet/arrow output
+    pa = None
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import scraper_common
+from scraper_common import (
+    timed, RateLimiter, ResponseCache, StageTimer, FixtureStore, DriverPool, RetryPolicy,
+    BaseScraper, resolve_excel_engine,
+)
+
+
 base_url = "https://www.actionsxchangerepository.fidelity.com/ShowDocument/ComplianceEnvelope.htm"
 job_name = "15225_Fidelty_Michael_SPD Scrape using requests/selennium"
 output_filename = (
     job_name.split("using")[0].strip().lower().replace(" ", "-") + "-sample.csv"
 )
 scrape_datetime = datetime.utcnow()
+output_format = os.environ.get("OUTPUT_FORMAT", "csv")  # csv, parquet or arrow
+parquet_compression = "zstd"
 proxy_address = os.environ.get("HTTP_PROXY")
+pool_connections = 4  # Number of hosts kept in the connection pool
+pool_maxsize = 10  # Keep-alive connections kept per host
+rate_limits = {
+    # host: requests per second, burst size, max extra jitter in seconds
+    "www.actionsxchangerepository.fidelity.com": {"rate": 1.0, "burst": 2, "jitter": 0.5},
+}
+default_rate_limit = {"rate": 0.5, "burst": 1, "jitter": 0.5}
+retry_statuses = {429, 500, 502, 503, 504}  # Responses worth retrying a single request for
+retry_backoff_base = 2  # Seconds before the first retry, doubled on every attempt
+retry_backoff_max = 60  # Upper bound for a single backoff in seconds
+retry_after_max = 300  # Longest Retry-After honoured, asking for more gives up on the request
+retry_budget = 20  # Request retries allowed across a whole run
+http_mode = os.environ.get("HTTP_MODE", "live")  # live, record or replay
+fixtures_dir = os.path.abspath("fixtures")  # Where record mode saves responses and replay mode reads them
+headless = os.environ.get("HEADLESS", "1") == "1"  # Run Chrome without a window
+etf_workers = 4  # ETFs processed at the same time, each in its own pooled Chrome
+driver_pool_size = etf_workers  # Browsers kept warm for the run
+driver_max_pages = 25  # Pages a browser serves before it is replaced
+holdings_columns = {
+    # Excel column: output column, in output order
+    'Ticker': 'ticker',
+    'ISIN': 'isin',
+    'Security Name': 'security_name',
+    'Security Type': 'security_type',
+    'Quantity Held': 'shares',
+    'Market Value': 'value',
+    '% of Net Assets': 'pct_assets',
+}
+excel_url_mode = os.environ.get("EXCEL_URL_MODE", "http")  # http reads the Excel link from the envelope page, browser always clicks DALYTab
+excel_urls_filename = "excel_urls.json"  # Resolved Excel link per ticker, reused until a download fails or its holdings date stops advancing
+holdings_store_dir = os.environ.get("HOLDINGS_STORE")  # Also keep every run in a partitioned Parquet holdings store here
+excel_link_pattern = re.compile(r"""["'](?P<url>[^"'<>\s]*documentExcel\.htm[^"'<>\s]*)["']""")
+daily_tab_pattern = re.compile(r"""<[^>]*id=["']DALYTab["'][^>]*>""")
+output_schema = {
+    # column: (type, format used to parse it) for parquet/arrow output
+    "scrape_datetime": ("timestamp", None),
+    "etf_ticker": ("string", None),
+    "etf_name": ("string", None),
+    "holdings_date": ("date", "%m-%d-%Y"),
+    "ticker": ("string", None),
+    "isin": ("string", None),
+    "security_name": ("string", None),
+    "security_type": ("string", None),
+    "shares": ("float", None),
+    "value": ("float", None),
+    "pct_assets": ("float", None),
+}
+cache_dir = os.path.abspath("http_cache")  # Conditional-GET cache for downloaded artifacts
+cache_max_bytes = 500 * 1024 * 1024  # Least recently used files are evicted past this size
+excel_engine = os.environ.get("EXCEL_ENGINE", "calamine")  # Rust-backed calamine, or a pandas engine such as openpyxl
 
 def retry(RETRY_START_SCRAPER):
-    RETRIES = 5
+    RETRIES = 2  # Last resort only, single requests are retried in make_request
     reattempt_delay_time = int(1.5 * 60)
     def wrapper(self, *args, **kwargs):
         success = RETRY_START_SCRAPER(self, *args, **kwargs)
@@ -49,11 +123,260 @@ def retry(RETRY_START_SCRAPER):
 
     return wrapper
 
-class Scraper:
+
+class ExcelUrlCache:
+    # Daily holdings Excel link per ticker, stored with the envelope URL it was resolved from
+    # and the holdings date of the last report downloaded for that ticker
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path, encoding="utf-8") as f:
+                self.urls = json.load(f)
+        except (OSError, ValueError):
+            self.urls = {}
+
+    def get(self, etf_ticker, url):
+        entry = self.urls.get(etf_ticker)
+        if entry is None or entry["url"] != url:
+            return None
+        return entry["excel_url"]
+
+    def set(self, etf_ticker, url, excel_url):
+        with self.lock:
+            previous = self.urls.get(etf_ticker, {})
+            self.urls[etf_ticker] = {
+                "url": url,
+                "excel_url": excel_url,
+                "resolved_at": datetime.utcnow().isoformat(),
+                "holdings_date": previous.get("holdings_date"),
+            }
+
+    def last_holdings_date(self, etf_ticker):
+        return self.urls.get(etf_ticker, {}).get("holdings_date")
+
+    def set_holdings_date(self, etf_ticker, holdings_date):
+        with self.lock:
+            if etf_ticker in self.urls:
+                self.urls[etf_ticker]["holdings_date"] = holdings_date
+
+    def save(self):
+        with self.lock:
+            temp_path = self.path + ".part"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(self.urls, f, indent=2)
+            os.replace(temp_path, self.path)
+
+
+class HoldingsStore:
+    # Holdings as holdings_date=/etf_ticker=/holdings.parquet partitions, mirrored into a covering SQLite table
+    # in index.sqlite so queries are answered from its indexes without opening any Parquet file.
+    # Rows are unique on (etf_ticker, holdings_date, isin), holdings without an ISIN such as cash fall back to their name.
+    numeric_columns = ['shares', 'value', 'pct_assets']
+    index_columns = ['etf_ticker', 'holdings_date', 'holding_key', 'etf_name', 'ticker', 'isin', 'security_name',
+                     'security_type', 'shares', 'value', 'pct_assets']
+    # Everything but the internal holding_key
+    result_columns = ("etf_ticker, holdings_date, etf_name, ticker, isin, security_name, security_type, "
+                      "shares, value, pct_assets")
+
+    def __init__(self, store_dir):
+        if pa is None:
+            raise ValueError("pyarrow IS REQUIRED FOR THE HOLDINGS STORE.")
+        self.store_dir = store_dir
+        self.lock = threading.Lock()
+        os.makedirs(store_dir, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(store_dir, "index.sqlite"), check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS partitions (
+                    etf_ticker TEXT NOT NULL,
+                    holdings_date TEXT NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    PRIMARY KEY (etf_ticker, holdings_date)
+                )"""
+            )
+            self.connection.execute("DROP TABLE IF EXISTS holdings")
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS holdings (
+                    etf_ticker TEXT NOT NULL,
+                    holdings_date TEXT NOT NULL,
+                    holding_key TEXT NOT NULL,
+                    etf_name TEXT,
+                    ticker TEXT,
+                    isin TEXT,
+                    security_name TEXT,
+                    security_type TEXT,
+                    shares REAL,
+                    value REAL,
+                    pct_assets REAL,
+                    PRIMARY KEY (etf_ticker, holdings_date, holding_key)
+                )"""
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS holdings_isin ON holdings (isin, holdings_date)")
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS holdings_weight ON holdings (holdings_date, pct_assets DESC)"
+            )
+        self.sync_index()
+
+    def partition_path(self, etf_ticker, holdings_date):
+        return os.path.join(
+            self.store_dir, f"holdings_date={holdings_date}", f"etf_ticker={etf_ticker}", "holdings.parquet"
+        )
+
+    def normalize(self, df):
+        # ISO dates sort and partition correctly, the numbers are stored as numbers instead of strings
+        df = df.drop(columns=['scrape_datetime'], errors='ignore').copy()
+        df['holdings_date'] = pd.to_datetime(df['holdings_date'], format='%m-%d-%Y').dt.strftime('%Y-%m-%d')
+        for column in self.numeric_columns:
+            df[column] = pd.to_numeric(df[column], errors='coerce')
+        for column in ['etf_ticker', 'etf_name', 'ticker', 'isin', 'security_name', 'security_type']:
+            df[column] = df[column].astype('string')
+        df['holding_key'] = df['isin'].fillna(df['security_name']).fillna('')
+        return df
+
+    def index_partition(self, etf_ticker, holdings_date, partition):
+        # The file's mtime and size are recorded with its rows, so a partition replaced without
+        # its index being updated is noticed and re-indexed by the next sync_index
+        stat = os.stat(self.partition_path(etf_ticker, holdings_date))
+        rows = partition[self.index_columns].astype(object).where(partition[self.index_columns].notna(), None)
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM holdings WHERE etf_ticker = ? AND holdings_date = ?", (etf_ticker, holdings_date)
+            )
+            self.connection.executemany(
+                f"INSERT INTO holdings ({', '.join(self.index_columns)}) "
+                f"VALUES ({', '.join('?' * len(self.index_columns))})",
+                rows.itertuples(index=False, name=None),
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO partitions VALUES (?, ?, ?, ?)",
+                (etf_ticker, holdings_date, stat.st_mtime_ns, stat.st_size),
+            )
+
+    def sync_index(self):
+        # Brings the index in line with the partitions on disk: new or changed files are re-indexed, missing ones dropped
+        with self.lock:
+            indexed = {
+                (etf_ticker, holdings_date): (mtime_ns, size)
+                for etf_ticker, holdings_date, mtime_ns, size in self.connection.execute("SELECT * FROM partitions")
+            }
+            on_disk = set()
+            for date_dir in os.listdir(self.store_dir):
+                if not date_dir.startswith("holdings_date="):
+                    continue
+                for ticker_dir in os.listdir(os.path.join(self.store_dir, date_dir)):
+                    key = (ticker_dir.partition("=")[2], date_dir.partition("=")[2])
+                    path = self.partition_path(*key)
+                    if not os.path.exists(path):
+                        continue
+                    on_disk.add(key)
+                    stat = os.stat(path)
+                    if indexed.get(key) != (stat.st_mtime_ns, stat.st_size):
+                        logging.info(f"Indexing holdings partition {path}")
+                        self.index_partition(*key, pd.read_parquet(path))
+
+            with self.connection:
+                for etf_ticker, holdings_date in set(indexed) - on_disk:
+                    for table in ("holdings", "partitions"):
+                        self.connection.execute(
+                            f"DELETE FROM {table} WHERE etf_ticker = ? AND holdings_date = ?", (etf_ticker, holdings_date)
+                        )
+
+    def rebuild_index(self):
+        # Throws the index away and rebuilds it from the partitions
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM holdings")
+            self.connection.execute("DELETE FROM partitions")
+        self.sync_index()
+
+    def write(self, df):
+        if df.empty:
+            return
+        df = self.normalize(df)
+        with self.lock:
+            for (etf_ticker, holdings_date), partition in df.groupby(['etf_ticker', 'holdings_date']):
+                path = self.partition_path(etf_ticker, holdings_date)
+                if os.path.exists(path):
+                    partition = pd.concat([pd.read_parquet(path), partition], ignore_index=True)
+                partition = partition.drop_duplicates(subset=['holding_key'], keep='last').reset_index(drop=True)
+
+                # The partition is replaced first and indexed after, a failure in between leaves a
+                # partition the index has not caught up with yet rather than index rows with no data
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temp_path = path + ".part"
+                pq.write_table(
+                    pa.Table.from_pandas(partition, preserve_index=False), temp_path, compression=parquet_compression
+                )
+                os.replace(temp_path, path)
+                try:
+                    self.index_partition(etf_ticker, holdings_date, partition)
+                except sqlite3.Error as e:
+                    logging.warning(f"Could not index {path} ({e}), it is re-indexed when the store is next opened")
+
+    def query(self, sql, params):
+        with self.lock:
+            return pd.read_sql_query(sql, self.connection, params=params)
+
+    def iso_date(self, value):
+        return pd.Timestamp(value).strftime('%Y-%m-%d')
+
+    def etfs_holding(self, isin, holdings_date=None):
+        # Every ETF that holds an ISIN, on one date or across the whole history
+        sql = "SELECT etf_ticker, holdings_date, shares, value, pct_assets FROM holdings WHERE isin = ?"
+        params = [isin]
+        if holdings_date is not None:
+            sql += " AND holdings_date = ?"
+            params.append(self.iso_date(holdings_date))
+        return self.query(sql + " ORDER BY holdings_date DESC, pct_assets DESC", params)
+
+    def top_weights(self, holdings_date, n=10, etf_ticker=None):
+        # Largest holdings by % of net assets on a date, across all ETFs or within one
+        sql = f"SELECT {self.result_columns} FROM holdings WHERE holdings_date = ?"
+        params = [self.iso_date(holdings_date)]
+        if etf_ticker is not None:
+            sql += " AND etf_ticker = ?"
+            params.append(etf_ticker)
+        params.append(n)
+        return self.query(sql + " ORDER BY pct_assets DESC LIMIT ?", params)
+
+    def etf_history(self, etf_ticker, start=None, end=None):
+        # An ETF's holdings on every stored date, optionally limited to a date range
+        sql = f"SELECT {self.result_columns} FROM holdings WHERE etf_ticker = ?"
+        params = [etf_ticker]
+        if start is not None:
+            sql += " AND holdings_date >= ?"
+            params.append(self.iso_date(start))
+        if end is not None:
+            sql += " AND holdings_date <= ?"
+            params.append(self.iso_date(end))
+        return self.query(sql + " ORDER BY holdings_date, pct_assets DESC", params)
+
+    def close(self):
+        self.connection.close()
+
+
+def make_sink(filename, columns):
+    return scraper_common.make_sink(
+        filename, columns, output_format, output_schema, parquet_compression
+    )
+
+
+class Scraper(BaseScraper):
     def __init__(self):
-        self.MASTER_LIST = []
-        self.MASTER_DF = pd.DataFrame()
-        self.driver = None
+        self.output_columns = ['scrape_datetime', 'etf_ticker', 'etf_name', 'holdings_date', 'ticker', 'isin',
+                               'security_name', 'security_type', 'shares', 'value', 'pct_assets']
+        super().__init__(pool_connections, pool_maxsize)
+        self.sink = None
+        self.rate_limiter = RateLimiter(rate_limits, default_rate_limit)
+        self.retry_policy = RetryPolicy(retry_statuses, retry_backoff_base, retry_backoff_max, retry_after_max, retry_budget)
+        self.timer = StageTimer(job_name, scrape_datetime)
+        self.fixtures = FixtureStore(fixtures_dir, http_mode)
+        self.cache = ResponseCache(cache_dir, cache_max_bytes)
+        self.excel_engine = resolve_excel_engine(excel_engine)
+        self.driver_pool = None
+        self.excel_urls = ExcelUrlCache(excel_urls_filename)
+        self.holdings_store = None
         self.historical = None
         self.my_dir = None
 
@@ -82,9 +405,7 @@ class Scraper:
         return proxies
 
 
-    def load_driver(self, downloads_path=None):
-        hdr = "Mozilla/5.0 (Linux; Android 6.0; Nexus 5 Build/MRA58N) AppleWebKit/537.36 \
-          (KHTML, like Gecko) Chrome/119.0.0.0 Mobile Safari/537.36"
+    def make_driver(self, downloads_path=None):
         proxies = self.get_proxies()
 
         prefs = {}
@@ -95,7 +416,10 @@ class Scraper:
                 "download.default_directory": downloads_path,
             }
 
+        # Chrome options
         chrome_options = webdriver.ChromeOptions()
+        if headless:
+            chrome_options.add_argument("--headless=new")
         chrome_options.add_argument("start-maximized")
         chrome_options.add_argument("--no-sandbox")
         chrome_options.add_argument("--disable-gpu")
@@ -113,18 +437,27 @@ class Scraper:
         if proxy_address:
             chrome_options.add_argument('--proxy-server='+proxy_address)
 
-        self.driver = webdriver.Chrome(options=chrome_options)
-        self.driver.execute_cdp_cmd('Network.setUserAgentOverride', {
+        driver = webdriver.Chrome(options=chrome_options)
+        driver.execute_cdp_cmd('Network.setUserAgentOverride', {
             "userAgent": 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'})
-        self.driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
-        self.driver.maximize_window()
-
-        self.driver.get("https://www.google.com/")
-        self.wait_for_page_to_load()
-
-
-    def wait_for_page_to_load(self):
-        while not self.driver.execute_script(
+        driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
+        if not headless:
+            driver.maximize_window()
+        return driver
+
+    def get_driver_pool(self):
+        # Browsers are started on first use and reused by every page that needs one
+        if self.driver_pool is None:
+            self.driver_pool = DriverPool(self.make_driver, driver_pool_size, driver_max_pages)
+        return self.driver_pool
+
+    def close_driver_pool(self):
+        if self.driver_pool is not None:
+            self.driver_pool.close()
+            self.driver_pool = None
+
+    def wait_for_page_to_load(self, driver):
+        while not driver.execute_script(
             "return document.readyState === 'complete';"
         ):
             time.sleep(1)
@@ -161,6 +494,16 @@ class Scraper:
         
         return s
 
+    def write_rows(self, df):
+        super().write_rows(df)
+        if self.holdings_store is not None:
+            self.write_holdings(df)
+
+    @timed("holdings_store")
+    def write_holdings(self, df):
+        self.holdings_store.write(df)
+
+
     def create_dir(self):
 
         temp = "resources"
@@ -182,145 +525,222 @@ class Scraper:
         else:
             logging.info(f'{self.my_dir} do not exists...')
  
+    @timed("transform")
     def parse_stock_data(self, df, etf_ticker, etf_name, holdings_date):
-        stock_data = {
-        'scrape_datetime': [],
-        'etf_ticker': [],
-        'etf_name': [],
-        'holdings_date':[],
-        'ticker': [],
-        'isin': [],
-        'security_name': [],
-        'security_type': [],
-        'shares': [],
-        'value': [],
-        'pct_assets': []
-        }
+        # Select and rename the holdings columns in one step, then broadcast the ETF metadata
+        stock_data_df = df[list(holdings_columns)].rename(columns=holdings_columns).reset_index(drop=True)
+        # Broadcasting a datetime gives datetime64[us], the list-built frame held datetime64[ns]
+        stock_data_df.insert(0, 'scrape_datetime', pd.Timestamp(scrape_datetime).as_unit('ns'))
+        stock_data_df.insert(1, 'etf_ticker', etf_ticker)
+        stock_data_df.insert(2, 'etf_name', etf_name)
+        stock_data_df.insert(3, 'holdings_date', holdings_date)
+        
+        # Same dtypes as building the frame from python lists, e.g. quantities with blanks become floats
+        return stock_data_df.infer_objects()
+    
+    def extract_holdings(self, df):
+        # Finds the header and "Total:" rows with whole-frame comparisons instead of walking every row
+        holdings_date = df.iloc[1, 1]
+        parsed_date = datetime.strptime(holdings_date, '%d-%b-%y')
+        holdings_date = parsed_date.strftime('%m-%d-%Y')
         
-        for index, row in df.iterrows():
-            stock_data['scrape_datetime'].append(scrape_datetime)
-            stock_data['etf_ticker'].append(etf_ticker)
-            stock_data['etf_name'].append(etf_name)
-            stock_data['holdings_date'].append(holdings_date)
-            stock_data['ticker'].append(row['Ticker'])
-            stock_data['isin'].append(row['ISIN'])
-            stock_data['security_name'].append(row['Security Name'])
-            stock_data['security_type'].append(row['Security Type'])
-            stock_data['shares'].append(row['Quantity Held'])
-            stock_data['value'].append(row['Market Value'])
-            stock_data['pct_assets'].append(row['% of Net Assets'])
-            
-        stock_data_df = pd.DataFrame(stock_data)
+        header_rows = (df.eq('Ticker').any(axis=1) & df.eq('ISIN').any(axis=1)).to_numpy().nonzero()[0]
+        if len(header_rows):
+            header_index = header_rows[0]
+            new_header = df.iloc[header_index + 1:]
+            new_header.columns = df.iloc[header_index].tolist()
+            new_header.reset_index(drop=True, inplace=True)
+            df = new_header
+        else:
+            logging.error("Ticker and ISIN not found in any row.")
         
-        return stock_data_df
+        total_rows = df.eq('Total:').any(axis=1).to_numpy().nonzero()[0]
+        if len(total_rows):
+            df = df.iloc[:total_rows[0]].reset_index(drop=True)
+        else:
+            logging.error("Total: not found in any row.")
+        
+        return holdings_date, df
     
-    def getting_data(self, session, excel_url, etf_ticker):
+    def getting_data(self, excel_url, etf_ticker):
         try:
-            excel_url_response = session.get(excel_url)
+            excel_url_response = self.make_request(excel_url, cache=True)
             if excel_url_response.status_code == 200:
                 logging.info(f"Sucessful request to load excel for {etf_ticker} ...")
                 
                 excel_data = BytesIO(excel_url_response.content)
-                df = pd.read_excel(excel_data)
-                
-                holdings_date = df.iloc[1, 1]
-                parsed_date = datetime.strptime(holdings_date, '%d-%b-%y')
-                holdings_date = parsed_date.strftime('%m-%d-%Y')
-                
-                header_index = -1
-                for index, row in df.iterrows():
-                    if 'Ticker' in row.values and 'ISIN' in row.values:
-                        header_index = index
-                        break
-                if header_index != -1:
-                    new_header = df.iloc[header_index + 1:]  
-                    new_header.columns = df.iloc[header_index].tolist() 
-                    new_header.reset_index(drop=True, inplace=True)
-                    df = new_header
-                else:
-                    logging.error("Ticker and ISIN not found in any row.")
-                
-                total_index = -1
-                for index, row in df.iterrows():
-                    if 'Total:' in row.values:
-                        total_index = index
-                        break
-    
-                if total_index != -1:
-                    df = df.drop(df.index[total_index:])
-                    df.reset_index(drop=True, inplace=True)
-                else:
-                    logging.error("Total: not found in any row.")
+                df = self.load_excel(excel_data)
                 
-                return holdings_date, df
+                return self.extract_holdings(df)
                 
             else:
                 logging.error(f"Something wrong while loading excel for {etf_ticker} ...")
         except:
             logging.error(f"Something wrong while loading excel for {etf_ticker} ...")
-            return pd.DataFrame()
+        return None, pd.DataFrame()
     
+    @timed("browser")
+    def resolve_excel_url(self, url):
+        # Opens the ETF envelope in Chrome and reads the daily holdings Excel link
+        if self.fixtures.replaying:
+            return self.fixtures.load_text(url)
+
+        try:
+            with self.get_driver_pool().driver() as driver:
+                driver.get(url)
+                self.wait_for_page_to_load(driver)
+                daily_tab = WebDriverWait(driver, 10).until(
+                    EC.presence_of_element_located((By.XPATH, '//*[@id="DALYTab"]')))
+                daily_tab.click()
+                
+                excel_link = WebDriverWait(driver, 10).until(
+                    EC.presence_of_element_located((By.XPATH, '//a[contains(@href, "documentExcel.htm")]'))
+                )
+                
+                excel_url = excel_link.get_attribute('href')
+        
+        except:
+            excel_url = "Not Available"
+
+        self.fixtures.record_text(url, excel_url)
+        return excel_url
+
+    def find_excel_link(self, text, page_url):
+        # Prefer the first Excel link after the daily tab, the envelope can also list other reports
+        matches = list(excel_link_pattern.finditer(text))
+        if not matches:
+            return None
+        daily_tab = text.find("DALY")
+        match = next((match for match in matches if match.start() > daily_tab), matches[0])
+        return urljoin(page_url, html.unescape(match.group("url")))
+
+    def resolve_excel_url_over_http(self, url):
+        # The daily tab's link is either in the envelope page already or in the page the tab loads
+        response = self.make_request(url)
+        if response.status_code != 200:
+            return None
+        page_url = response.url or url
+        excel_url = self.find_excel_link(response.text, page_url)
+        if excel_url is not None:
+            return excel_url
+
+        daily_tab = daily_tab_pattern.search(response.text)
+        href = re.search(r"""href=["']([^"']+)["']""", daily_tab.group(0)) if daily_tab else None
+        if href is None or href.group(1).startswith(("#", "javascript")):
+            return None
+        tab_url = urljoin(page_url, html.unescape(href.group(1)))
+        response = self.make_request(tab_url)
+        if response.status_code != 200:
+            return None
+        return self.find_excel_link(response.text, response.url or tab_url)
+
+    def find_excel_url(self, etf_ticker, url):
+        excel_url = None
+        if excel_url_mode == "http":
+            try:
+                excel_url = self.resolve_excel_url_over_http(url)
+            except requests.RequestException as e:
+                logging.error(f"Error resolving the Excel link for {etf_ticker}: {e}")
+            if excel_url is None:
+                logging.info(f"No Excel link found over HTTP for {etf_ticker}, falling back to selenium")
+
+        if excel_url is None:
+            excel_url = self.resolve_excel_url(url)
+        if excel_url != "Not Available":
+            self.excel_urls.set(etf_ticker, url, excel_url)
+        return excel_url
+
+    def scrape_etf(self, etf_ticker, etf_name, url):
+        cached_url = self.excel_urls.get(etf_ticker, url)
+        excel_url = cached_url or self.find_excel_url(etf_ticker, url)
+        
+        logging.info(f"Getting data for ETF Ticker: {etf_ticker}")
+        if excel_url == "Not Available":
+            logging.info(f"No Daily Holdings Report link for {etf_ticker}")
+            return pd.DataFrame()
+        
+        logging.info(f"Got the Daily Holdings Report link for {etf_ticker}")
+        holdings_date, df = self.getting_data(excel_url, etf_ticker)
+        last_holdings_date = self.excel_urls.last_holdings_date(etf_ticker)
+        if cached_url is not None and (df.empty or not self.holdings_date_advanced(holdings_date, last_holdings_date)):
+            # A link that stopped moving may point at an old report, so the envelope is read again.
+            # Only a different link is downloaded, the same one would just return the report already read.
+            logging.info(f"Cached Excel link for {etf_ticker} failed or is stale, resolving it again")
+            excel_url = self.find_excel_url(etf_ticker, url)
+            if excel_url not in ("Not Available", cached_url):
+                holdings_date, df = self.getting_data(excel_url, etf_ticker)
+        if df.empty:
+            logging.info(f"Something went wront with getting Daily Holding Data for {etf_ticker}")
+            return df
+        if not self.holdings_date_advanced(holdings_date, last_holdings_date):
+            logging.warning(f"Holdings date for {etf_ticker} is still {holdings_date}, same as the last run")
+        self.excel_urls.set_holdings_date(etf_ticker, holdings_date)
+        return self.parse_stock_data(df, etf_ticker, etf_name, holdings_date)
+
+    def holdings_date_advanced(self, holdings_date, last_holdings_date):
+        if holdings_date is None or last_holdings_date is None:
+            return True
+        return datetime.strptime(holdings_date, '%m-%d-%Y') > datetime.strptime(last_holdings_date, '%m-%d-%Y')
+
+
+    async def scrape_etfs(self, etfs, emit):
+        # ETFs run on etf_workers threads, each checking a browser out of the pool.
+        # Finished ETFs are handed to emit in table1.csv order as soon as their turn comes.
+        semaphore = asyncio.Semaphore(etf_workers)
+        finished = {}
+        next_index = 0
+
+        async def scrape_one(index, etf_ticker, etf_name, url):
+            nonlocal next_index
+            async with semaphore:
+                finished[index] = await asyncio.to_thread(self.scrape_etf, etf_ticker, etf_name, url)
+
+            while next_index in finished:
+                emit(finished.pop(next_index))
+                next_index += 1
+
+        await asyncio.gather(*(scrape_one(index, *etf) for index, etf in enumerate(etfs)))
+
     def scrape_data(self, base_url: str) -> bool:
         logging.info(f"PROCESSING PAGE: {base_url}")
         
-        session = self.make_session()
-        
         cwd = os.getcwd()
         file_name = "table1.csv"
         file_path = os.path.join(cwd, file_name)
         table1 = pd.read_csv(file_path)
-        self.load_driver()
+        etfs = list(table1[['etf_ticker', 'etf_name', 'url']].itertuples(index=False, name=None))
         
-        for index, row in table1.iterrows():
-            etf_ticker = row['etf_ticker']
-            etf_name = row['etf_name']
-            url = row['url']
+        # Created up front so every worker shares one pooled session for the Excel downloads
+        self.get_session()
+        logging.info(f"Processing {len(etfs)} ETFs with {etf_workers} workers...")
+        if holdings_store_dir:
             try:
-                self.driver.get(url)
-                self.wait_for_page_to_load()
-                daily_tab = WebDriverWait(self.driver, 10).until(
-                    EC.presence_of_element_located((By.XPATH, '//*[@id="DALYTab"]')))
-                daily_tab.click()
-                
-                excel_link = WebDriverWait(self.driver, 10).until(
-                    EC.presence_of_element_located((By.XPATH, '//a[contains(@href, "documentExcel.htm")]'))
-                )
-                
-                excel_url = excel_link.get_attribute('href')
-            
-            except:
-                excel_url = "Not Available"
-            
-            logging.info(f"Getting data for ETF Ticker: {etf_ticker}")
-            if excel_url != "Not Available":
-                logging.info(f"Got the Daily Holdings Report link for {etf_ticker}")
-                
-                holdings_date, df = self.getting_data(session, excel_url, etf_ticker)
-                if not df.empty:
-                    data = self.parse_stock_data(df,etf_ticker, etf_name, holdings_date)
-                    self.MASTER_DF = pd.concat([self.MASTER_DF, data], axis = 0, ignore_index=True)
-                    self.MASTER_DF = self.MASTER_DF.reset_index(drop=True)
-                else:
-                    logging.info(f"Something went wront with getting Daily Holding Data for {etf_ticker}")
-                    
-            else:
-                logging.info(f"No Daily Holdings Report link for {etf_ticker}")
+                self.holdings_store = HoldingsStore(holdings_store_dir)
+            except ValueError as e:
+                logging.error(f"{e} HOLDINGS STORE NOT UPDATED.")
+        try:
+            asyncio.run(self.scrape_etfs(etfs, self.write_rows))
+        finally:
+            if self.holdings_store is not None:
+                self.holdings_store.close()
+                self.holdings_store = None
+        self.excel_urls.save()
                 
-        if not self.MASTER_DF.empty:
+        if self.sink.rows_written:
             success = True
         else:
             success = False
-        self.driver.close()
         return success
 
     @retry
     def start_scraper(self, historical) -> list:
         self.historical = historical
+        if self.sink is not None:
+            self.sink.open()
         page_url = f"{base_url}"
         success = self.scrape_data(page_url)
 
         if not success:
-            self.MASTER_DF = pd.DataFrame()
             self.remove_dir()
             logging.error("SCRAPER FAILED. RETRYING...")
 
@@ -328,27 +748,32 @@ class Scraper:
 
 def run(filename: str):
     scraper = Scraper()
-    success = scraper.start_scraper(historical=False)
+    try:
+        scraper.sink = make_sink(filename, scraper.output_columns)
+    except ValueError as e:
+        logging.info(f"{e} OUTPUT FILE NOT GENERATED.")
+        return
+
+    try:
+        success = scraper.start_scraper(historical=False)
+    finally:
+        scraper.close_session()
+        scraper.close_driver_pool()
+        scraper.sink.close()
+        logging.info("STAGE TIMINGS\n" + scraper.timer.summary(scraper.sink.rows_written))
+        scraper.timer.save(os.path.splitext(filename)[0] + "-timings.json", scraper.sink.rows_written)
 
     if not success:
-        logging.error("FINAL ATTEMPT FAILED. EXITING...")
+        logging.error(f"FINAL ATTEMPT FAILED. PARTIAL OUTPUT KEPT IN {scraper.sink.temp_filename}. EXITING...")
         return
 
-    outputs = scraper.MASTER_DF
-    
-    if outputs.columns[0] == "scrape_datetime":
+    if scraper.sink.rows_written:
         logging.info("GENERATING FINAL OUTPUT...")
-        outputs.to_csv(
-            filename,
-            encoding="utf-8",
-            quotechar='"',
-            quoting=csv.QUOTE_ALL,
-            index=False,
-        )
+        scraper.sink.finalize()
     else:
-        logging.info(
-            'MISSING "scrape_datetime" COLUMN OR IT IS NOT THE FIRST COLUMN. CSV FILE NOT GENERATED.'
-        )
+        os.remove(scraper.sink.temp_filename)
+        logging.error("No data scraped ...")
+
 
 if __name__ == "__main__":
     run(filename=output_filename)
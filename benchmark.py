@@ -0,0 +1,329 @@
+import os
+import sys
+import csv
+import json
+import time
+import logging
+import argparse
+import tempfile
+import tracemalloc
+import importlib.util
+from datetime import datetime
+
+import pandas as pd
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# State scrape_data expects for each project
+PROJECTS = {
+    "14751_Marcel_IPD": {"historical": True},
+    "15141_Dexus_Jack_IPD": {"historical": False},
+    "15171_AHRI_Jack_IPD": {"historical": True},
+    "15206_HKEX_David_IPD": {"historical": False},
+    "15225_Fidelty_Michael_SPD": {"historical": False},
+}
+
+
+def load_scraper_module(project):
+    spec = importlib.util.spec_from_file_location(f"scrape_{project}", os.path.join(ROOT, project, "scrape.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def read_rows(filename):
+    # Output rows without scrape_datetime, which differs between runs
+    with open(filename, encoding="utf-8", newline="") as f:
+        return [{k: v for k, v in row.items() if k != "scrape_datetime"} for row in csv.DictReader(f)]
+
+
+def benchmark_project(project, output_dir, html_parser=None):
+    config = PROJECTS[project]
+    if html_parser is not None:
+        os.environ["HTML_PARSER"] = html_parser
+    output_filename = os.path.join(output_dir, f"{project}-{html_parser or 'default'}.csv")
+    cwd = os.getcwd()
+    os.chdir(os.path.join(ROOT, project))
+    try:
+        module = load_scraper_module(project)
+        scraper = module.Scraper()
+        scraper.historical = config["historical"]
+        scraper.sink = module.make_sink(output_filename, scraper.output_columns)
+        scraper.sink.open()
+        scraper.timer = module.StageTimer(module.job_name, module.scrape_datetime)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        success = scraper.scrape_data(module.base_url)
+        elapsed = time.perf_counter() - start
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        scraper.sink.close()
+    finally:
+        os.chdir(cwd)
+
+    rows = scraper.sink.rows_written
+    return {
+        "project": project,
+        "html_parser": getattr(scraper, "html_parser", None),
+        "output": output_filename,
+        "success": success,
+        "seconds": elapsed,
+        "rows": rows,
+        "rows_per_second": rows / elapsed if elapsed else 0.0,
+        "peak_memory_mb": peak_memory / (1024 * 1024),
+        "stages": scraper.timer.stages,
+    }
+
+
+def synthetic_holdings_sheet(rows):
+    # Shaped like a Fidelity daily holdings download after pd.read_excel: preamble, header, holdings, total, notes
+    width = 7
+    blank = [None] * width
+    sheet = [
+        ["Fund Name:", "Synthetic Holdings ETF"] + blank[2:],
+        ["Holdings as of:", "15-Mar-24"] + blank[2:],
+        blank,
+        ["Ticker", "ISIN", "Security Name", "Security Type", "Quantity Held", "Market Value", "% of Net Assets"],
+    ]
+    for i in range(rows):
+        sheet.append([
+            f"T{i}",
+            f"US{i:010d}",
+            f"Security {i}",
+            "Common Stock" if i % 10 else "Cash",
+            i * 10 if i % 50 else None,  # Blank quantities, as cash lines have
+            round(i * 1.5, 2),
+            round(1 / (i + 1), 6),
+        ])
+    sheet.append(["Total:", None, None, None, None, round(sum(i * 1.5 for i in range(rows)), 2), 100.0])
+    sheet.append(blank)
+    sheet.append(["Holdings are subject to change."] + blank[1:])
+    return pd.DataFrame(sheet, columns=[f"Unnamed: {i}" for i in range(width)], dtype=object)
+
+
+def reference_holdings(df, etf_ticker, etf_name, scrape_datetime):
+    # The row-by-row getting_data/parse_stock_data the vectorized normalizer replaced, kept to check its output
+    holdings_date = datetime.strptime(df.iloc[1, 1], '%d-%b-%y').strftime('%m-%d-%Y')
+
+    header_index = -1
+    for index, row in df.iterrows():
+        if 'Ticker' in row.values and 'ISIN' in row.values:
+            header_index = index
+            break
+    if header_index != -1:
+        new_header = df.iloc[header_index + 1:]
+        new_header.columns = df.iloc[header_index].tolist()
+        new_header.reset_index(drop=True, inplace=True)
+        df = new_header
+
+    total_index = -1
+    for index, row in df.iterrows():
+        if 'Total:' in row.values:
+            total_index = index
+            break
+    if total_index != -1:
+        df = df.drop(df.index[total_index:])
+        df.reset_index(drop=True, inplace=True)
+
+    stock_data = {column: [] for column in [
+        'scrape_datetime', 'etf_ticker', 'etf_name', 'holdings_date', 'ticker', 'isin',
+        'security_name', 'security_type', 'shares', 'value', 'pct_assets',
+    ]}
+    for index, row in df.iterrows():
+        stock_data['scrape_datetime'].append(scrape_datetime)
+        stock_data['etf_ticker'].append(etf_ticker)
+        stock_data['etf_name'].append(etf_name)
+        stock_data['holdings_date'].append(holdings_date)
+        stock_data['ticker'].append(row['Ticker'])
+        stock_data['isin'].append(row['ISIN'])
+        stock_data['security_name'].append(row['Security Name'])
+        stock_data['security_type'].append(row['Security Type'])
+        stock_data['shares'].append(row['Quantity Held'])
+        stock_data['value'].append(row['Market Value'])
+        stock_data['pct_assets'].append(row['% of Net Assets'])
+    return pd.DataFrame(stock_data)
+
+
+def benchmark_holdings(rows, repeat=3):
+    project = "15225_Fidelty_Michael_SPD"
+    cwd = os.getcwd()
+    os.chdir(os.path.join(ROOT, project))
+    try:
+        module = load_scraper_module(project)
+        scraper = module.Scraper()
+    finally:
+        os.chdir(cwd)
+
+    sheet = synthetic_holdings_sheet(rows)
+    timings = {"reference": [], "vectorized": []}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        expected = reference_holdings(sheet, "SYN", "Synthetic Holdings ETF", module.scrape_datetime)
+        timings["reference"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        holdings_date, holdings = scraper.extract_holdings(sheet)
+        actual = scraper.parse_stock_data(holdings, "SYN", "Synthetic Holdings ETF", holdings_date)
+        timings["vectorized"].append(time.perf_counter() - start)
+
+    reference_seconds = min(timings["reference"])
+    vectorized_seconds = min(timings["vectorized"])
+    return {
+        "rows": rows,
+        "reference_seconds": reference_seconds,
+        "vectorized_seconds": vectorized_seconds,
+        "speedup": reference_seconds / vectorized_seconds if vectorized_seconds else 0.0,
+        "identical_rows": expected.equals(actual),
+    }
+
+
+def print_holdings_report(results):
+    print(f"{'holdings':>10}{'loop s':>12}{'vector s':>12}{'speedup':>10}  identical")
+    for result in results:
+        print(
+            f"{result['rows']:>10}{result['reference_seconds']:>12.4f}{result['vectorized_seconds']:>12.4f}"
+            f"{result['speedup']:>9.1f}x  {result['identical_rows']}"
+        )
+
+
+def synthetic_shipments_workbook(rows, path):
+    # Shaped like an AHRI monthly shipments workbook, with extra columns the scraper never reads
+    df = pd.DataFrame({
+        "Product_Type": [f"Product {i % 40}" for i in range(rows)],
+        "Month_to_Date_Units": [i * 3 for i in range(rows)],
+        "Year_to_Date_Units": [i * 12 for i in range(rows)],
+        "Previous_Year_Units": [i * 11 for i in range(rows)],
+        "Percent_Change": [round(i / (rows + 1), 4) for i in range(rows)],
+        "Notes": ["Shipments include units for export" for _ in range(rows)],
+    })
+    df.to_excel(path, index=False)
+    return path
+
+
+def benchmark_excel(source, output_dir, repeat=3):
+    if str(source).isdigit():
+        path = synthetic_shipments_workbook(int(source), os.path.join(output_dir, f"shipments-{source}.xlsx"))
+    else:
+        path = os.path.abspath(source)
+    columns = ["Product_Type", "Month_to_Date_Units"]
+    reads = {
+        "default": {"engine": None},
+        "calamine": {"engine": "calamine"},
+        "calamine_projected": {"engine": "calamine", "usecols": lambda column: column in columns},
+    }
+
+    result = {"workbook": os.path.basename(path), "size_mb": os.path.getsize(path) / (1024 * 1024)}
+    frames = {}
+    for name, kwargs in reads.items():
+        seconds = []
+        try:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                frames[name] = pd.read_excel(path, **kwargs)
+                seconds.append(time.perf_counter() - start)
+        except ImportError as e:
+            print(f"Skipping {name}: {e}", file=sys.stderr)
+            continue
+        result[f"{name}_seconds"] = min(seconds)
+
+    if "calamine" in frames:
+        result["identical_rows"] = frames["default"].equals(frames["calamine"])
+        result["identical_projected_rows"] = frames["default"][
+            [column for column in frames["default"].columns if column in columns]
+        ].equals(frames["calamine_projected"])
+    return result
+
+
+def print_excel_report(results):
+    print(f"{'workbook':<28}{'MB':>8}{'default s':>12}{'calamine s':>12}{'projected s':>13}  identical")
+    for result in results:
+        print(
+            f"{result['workbook']:<28}{result['size_mb']:>8.1f}{result['default_seconds']:>12.3f}"
+            f"{result.get('calamine_seconds', float('nan')):>12.3f}"
+            f"{result.get('calamine_projected_seconds', float('nan')):>13.3f}"
+            f"  {result.get('identical_rows')}/{result.get('identical_projected_rows')}"
+        )
+
+
+def print_report(results):
+    print(f"{'project':<28}{'parser':<14}{'seconds':>10}{'rows':>8}{'rows/sec':>12}{'peak MB':>10}")
+    for result in results:
+        print(
+            f"{result['project']:<28}{str(result['html_parser']):<14}{result['seconds']:>10.3f}{result['rows']:>8}"
+            f"{result['rows_per_second']:>12.1f}{result['peak_memory_mb']:>10.1f}"
+        )
+        for stage, timing in result["stages"].items():
+            print(f"    {stage:<24}{timing['seconds']:>10.3f}s {timing['calls']:>6} calls")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time every scraper end to end against recorded fixtures.")
+    parser.add_argument("projects", nargs="*", default=list(PROJECTS), help="project folders to benchmark")
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    parser.add_argument(
+        "--parsers",
+        nargs="+",
+        help="run each project once per HTML parser (e.g. lxml html.parser) and check the rows are identical",
+    )
+    parser.add_argument(
+        "--holdings",
+        nargs="+",
+        type=int,
+        help="instead, time the Fidelity holdings normalizer on synthetic sheets of these sizes against the old loops",
+    )
+    parser.add_argument(
+        "--excel",
+        nargs="+",
+        help="instead, time pd.read_excel engines on workbooks: a path, or a row count for a synthetic AHRI-style sheet",
+    )
+    args = parser.parse_args()
+
+    # Fixtures are recorded per project with HTTP_MODE=record python scrape.py
+    os.environ["HTTP_MODE"] = "replay"
+    if args.parsers:
+        os.environ["OUTPUT_FORMAT"] = "csv"  # Rows are compared from the CSV output
+    logging.disable(logging.INFO)
+
+    if args.excel:
+        with tempfile.TemporaryDirectory() as output_dir:
+            results = [benchmark_excel(source, output_dir) for source in args.excel]
+        print_excel_report(results)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+        return
+
+    if args.holdings:
+        results = [benchmark_holdings(rows) for rows in args.holdings]
+        print_holdings_report(results)
+        for result in results:
+            if not result["identical_rows"]:
+                print(f"{result['rows']} holdings: vectorized rows differ from the loop implementation", file=sys.stderr)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        for project in args.projects:
+            if not os.path.isdir(os.path.join(ROOT, project, "fixtures")):
+                print(f"Skipping {project}: no fixtures recorded", file=sys.stderr)
+                continue
+            runs = [benchmark_project(project, output_dir, html_parser) for html_parser in args.parsers or [None]]
+            for run in runs[1:]:
+                run["identical_rows"] = read_rows(run["output"]) == read_rows(runs[0]["output"])
+                if not run["identical_rows"]:
+                    print(f"{project}: rows from {run['html_parser']} differ from {runs[0]['html_parser']}", file=sys.stderr)
+            results.extend(runs)
+
+        print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
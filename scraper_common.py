@@ -0,0 +1,630 @@
+import os
+import csv
+import time
+import json
+import queue
+import random
+import hashlib
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Only needed for parquet/arrow output
+    pa = None
+
+try:
+    from bs4 import BeautifulSoup, FeatureNotFound
+except ImportError:  # Only needed by projects that parse HTML
+    BeautifulSoup = None
+
+try:
+    import python_calamine
+except ImportError:  # Only needed for the calamine Excel engine
+    python_calamine = None
+
+try:
+    from selenium.common.exceptions import WebDriverException
+except ImportError:  # Only needed by projects that drive a browser
+    class WebDriverException(Exception):
+        pass
+
+
+# Building blocks shared by every project's scrape.py, anything that differs per project is passed in
+
+
+def timed(stage):
+    # Adds the decorated method's run time to a stage of self.timer
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.timer.stage(stage):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def resolve_html_parser(preferred):
+    # Falls back to the pure-python html.parser when the C-backed parser is not installed
+    try:
+        BeautifulSoup("", preferred)
+        return preferred
+    except FeatureNotFound:
+        logging.warning(f"HTML parser {preferred} is not available, falling back to html.parser")
+        return "html.parser"
+
+
+def resolve_excel_engine(preferred):
+    # Falls back to pandas' default engine for the file type when python-calamine is not installed
+    if preferred == "calamine" and python_calamine is None:
+        logging.warning("Excel engine calamine is not available, falling back to the pandas default")
+        return None
+    return preferred
+
+
+class RateLimiter:
+    # Per-host token bucket: requests only wait once a host's burst budget is spent
+    def __init__(self, limits, default):
+        self.limits = limits
+        self.default = default
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def wait(self, url):
+        host = urlparse(url).netloc
+        limit = self.limits.get(host, self.default)
+        rate, burst, jitter = limit["rate"], limit["burst"], limit["jitter"]
+
+        with self.lock:
+            now = time.monotonic()
+            tokens, updated = self.buckets.get(host, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate) - 1
+            self.buckets[host] = (tokens, now)
+
+        if tokens < 0:
+            time.sleep(-tokens / rate + random.uniform(0, jitter))
+
+
+class RetryPolicy:
+    # When a failed request is retried and for how long it backs off, with one retry budget for the whole run
+    def __init__(self, statuses, backoff_base, backoff_max, retry_after_max, budget):
+        self.statuses = statuses
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_after_max = retry_after_max
+        self.budget = budget
+        self.lock = threading.Lock()
+
+    def delay(self, attempt, response=None):
+        # Exponential backoff with jitter, stretched to honour a Retry-After header.
+        # None means the server asked to wait longer than retry_after_max, so the request is given up.
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        delay = random.uniform(delay / 2, delay)
+
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            if retry_after.strip().isdigit():
+                delay = max(delay, int(retry_after))
+            else:
+                try:
+                    retry_at = parsedate_to_datetime(retry_after)
+                    delay = max(delay, (retry_at - datetime.now(timezone.utc)).total_seconds())
+                except (TypeError, ValueError):
+                    pass
+        if delay > self.retry_after_max:
+            return None
+        return delay
+
+    def take(self):
+        # Parallel requests share the run's retry budget
+        with self.lock:
+            if self.budget <= 0:
+                return False
+            self.budget -= 1
+            return True
+
+
+class ResponseCache:
+    # On-disk bodies keyed by URL with their ETag/Last-Modified, LRU-evicted past max_bytes
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def body_path(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode("utf-8")).hexdigest())
+
+    def validators(self, url):
+        entry = self.index.get(url)
+        if entry is None or not os.path.exists(self.body_path(url)):
+            return {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def update(self, url, response):
+        # Serve a 304 from disk, remember a fresh 200 that carries validators
+        with self.lock:
+            if response.status_code == 304 and url in self.index:
+                try:
+                    with open(self.body_path(url), "rb") as f:
+                        response._content = f.read()
+                except OSError:
+                    return response
+                response.status_code = 200
+                self.index[url]["last_used"] = time.time()
+                self.save_index()
+                logging.info(f"Not modified, serving {url} from cache")
+
+            elif response.status_code == 200:
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+                if not etag and not last_modified:
+                    return response
+                with open(self.body_path(url), "wb") as f:
+                    f.write(response.content)
+                self.index[url] = {
+                    "etag": etag,
+                    "last_modified": last_modified,
+                    "size": len(response.content),
+                    "last_used": time.time(),
+                }
+                self.evict()
+                self.save_index()
+        return response
+
+    def evict(self):
+        total = sum(entry["size"] for entry in self.index.values())
+        for url, entry in sorted(self.index.items(), key=lambda item: item[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self.body_path(url))
+            except OSError:
+                pass
+            total -= entry["size"]
+            del self.index[url]
+
+    def save_index(self):
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.index, f)
+        os.replace(temp_path, self.index_path)
+
+
+class StageTimer:
+    # Duration and call count per pipeline stage (fetch, parse, transform, write) of a run
+    def __init__(self, job_name, scrape_datetime):
+        self.job_name = job_name
+        self.scrape_datetime = scrape_datetime
+        self.stages = {}
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                entry = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+                entry["seconds"] += elapsed
+                entry["calls"] += 1
+
+    def report(self, rows):
+        return {
+            "job_name": self.job_name,
+            "scrape_datetime": self.scrape_datetime.isoformat(),
+            "total_seconds": time.perf_counter() - self.started,
+            "rows": rows,
+            "stages": self.stages,
+        }
+
+    def summary(self, rows):
+        report = self.report(rows)
+        lines = [f"{'stage':<14}{'seconds':>10}{'calls':>8}"]
+        for name, entry in sorted(self.stages.items(), key=lambda item: -item[1]["seconds"]):
+            lines.append(f"{name:<14}{entry['seconds']:>10.2f}{entry['calls']:>8}")
+        lines.append(f"{'total':<14}{report['total_seconds']:>10.2f}{rows:>8} rows")
+        return "\n".join(lines)
+
+    def save(self, filename, rows):
+        with open(filename, "w", encoding="utf-8") as f:
+            json.dump(self.report(rows), f, indent=2)
+
+
+class FixtureStore:
+    # Records every response of a run to disk, or serves them back offline in replay mode
+    def __init__(self, fixtures_dir, mode):
+        self.fixtures_dir = fixtures_dir
+        self.recording = mode == "record"
+        self.replaying = mode == "replay"
+        self.index_path = os.path.join(fixtures_dir, "index.json")
+        self.cursors = {}
+        self.lock = threading.Lock()
+        self.index = {}
+        if self.recording:
+            os.makedirs(fixtures_dir, exist_ok=True)
+        if os.path.exists(self.index_path) and not self.recording:
+            with open(self.index_path, encoding="utf-8") as f:
+                self.index = json.load(f)
+
+    def key(self, *parts):
+        return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+    def encode(self, data):
+        if data is None:
+            return ""
+        if isinstance(data, dict):
+            return json.dumps(data, sort_keys=True)
+        return str(data)
+
+    def path(self, name):
+        return os.path.join(self.fixtures_dir, name)
+
+    def record(self, method, url, data, response):
+        if not self.recording:
+            return
+        key = self.key(method, url, self.encode(data))
+        with self.lock:
+            with open(self.path(key + ".body"), "wb") as f:
+                f.write(response.content)
+            with open(self.path(key + ".json"), "w", encoding="utf-8") as f:
+                json.dump({
+                    "method": method,
+                    "url": url,
+                    "data": self.encode(data),
+                    "status_code": response.status_code,
+                    "headers": dict(response.headers),
+                }, f, indent=2)
+            # Replay falls back to recording order when a request body differs, e.g. a moving date range
+            self.index.setdefault(self.key(method, url), []).append(key)
+            with open(self.index_path, "w", encoding="utf-8") as f:
+                json.dump(self.index, f)
+
+    def load(self, method, url, data):
+        key = self.key(method, url, self.encode(data))
+        with self.lock:
+            if not os.path.exists(self.path(key + ".json")):
+                request_key = self.key(method, url)
+                recorded = self.index.get(request_key, [])
+                position = self.cursors.get(request_key, 0)
+                if position >= len(recorded):
+                    raise requests.RequestException(f"No recorded response for {method} {url}")
+                key = recorded[position]
+                self.cursors[request_key] = position + 1
+
+        with open(self.path(key + ".json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(self.path(key + ".body"), "rb") as f:
+            content = f.read()
+
+        response = requests.Response()
+        response.status_code = meta["status_code"]
+        response.headers.update(meta["headers"])
+        response.url = url
+        response._content = content
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response._content_consumed = True  # Lets iter_content stream the stored body
+        return response
+
+    def record_text(self, name, text):
+        # Browser-rendered pages and values have no HTTP response, so they are stored as text
+        if not self.recording:
+            return
+        with open(self.path(self.key("text", name) + ".txt"), "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def load_text(self, name):
+        try:
+            with open(self.path(self.key("text", name) + ".txt"), encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise requests.RequestException(f"No recorded page for {name}")
+
+
+class CsvSink:
+    # Streams rows into a ".part" file as they are scraped and renames it into place on finalize
+    # scrape_datetime leads the columns, or ends them where a project's output always had it last
+    def __init__(self, filename, columns, datetime_column=0):
+        if columns[datetime_column] != "scrape_datetime":
+            position = "FIRST" if datetime_column == 0 else "LAST"
+            raise ValueError(f'MISSING "scrape_datetime" COLUMN OR IT IS NOT THE {position} COLUMN.')
+        self.filename = filename
+        self.columns = columns
+        self.temp_filename = filename + ".part"
+        self.file = None
+        self.rows_written = 0
+        self.lock = threading.Lock()
+
+    def open(self):
+        self.close()
+        self.file = open(self.temp_filename, "w", encoding="utf-8", newline="")
+        self.rows_written = 0
+        self.write_frame(pd.DataFrame(columns=self.columns), header=True)
+
+    def open_append(self):
+        # Polling appends every batch of new rows straight to the final file
+        self.close()
+        new_file = not os.path.exists(self.filename)
+        self.file = open(self.filename, "a", encoding="utf-8", newline="")
+        self.rows_written = 0
+        if new_file:
+            self.write_frame(pd.DataFrame(columns=self.columns), header=True)
+
+    def write(self, df):
+        if df.empty:
+            return
+        with self.lock:
+            self.write_frame(df.reindex(columns=self.columns), header=False)
+            self.rows_written += len(df)
+
+    def write_frame(self, df, header):
+        df.to_csv(
+            self.file,
+            header=header,
+            quotechar='"',
+            quoting=csv.QUOTE_ALL,
+            index=False,
+        )
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def finalize(self):
+        self.close()
+        os.replace(self.temp_filename, self.filename)
+
+
+class ArrowSink(CsvSink):
+    # Same streaming contract as CsvSink, writing typed Parquet row groups or Arrow IPC batches
+    arrow_types = {
+        "string": "string",
+        "float": "float64",
+        "int": "int64",
+        "date": "date32",
+        "timestamp": "timestamp[us]",
+    }
+
+    def __init__(self, filename, columns, schema, output_format, compression, datetime_column=0):
+        if pa is None:
+            raise ValueError(f"pyarrow IS REQUIRED FOR {output_format.upper()} OUTPUT.")
+        super().__init__(filename, columns, datetime_column)
+        self.output_format = output_format
+        self.compression = compression
+        self.types = {column: schema.get(column, ("string", None)) for column in columns}
+        self.schema = pa.schema(
+            [(column, pa.type_for_alias(self.arrow_types[kind])) for column, (kind, fmt) in self.types.items()]
+        )
+
+    def open(self):
+        self.close()
+        self.rows_written = 0
+        if self.output_format == "parquet":
+            self.file = pq.ParquetWriter(self.temp_filename, self.schema, compression=self.compression)
+        else:
+            self.file = pa.ipc.new_file(self.temp_filename, self.schema)
+
+    def write(self, df):
+        if df.empty:
+            return
+        with self.lock:
+            self.file.write_table(self.to_table(df))
+            self.rows_written += len(df)
+
+    def to_table(self, df):
+        df = df.reindex(columns=self.columns)
+        for column, (kind, fmt) in self.types.items():
+            if kind == "float":
+                df[column] = pd.to_numeric(df[column], errors="coerce")
+            elif kind == "int":
+                # Excel counts often arrive as floats such as 1234.0000001, which Int64 refuses unrounded
+                df[column] = pd.to_numeric(df[column], errors="coerce").round().astype("Int64")
+            elif kind == "date":
+                df[column] = pd.to_datetime(df[column], format=fmt, errors="coerce").dt.date
+            elif kind == "timestamp":
+                df[column] = pd.to_datetime(df[column], format=fmt, errors="coerce")
+            else:
+                df[column] = df[column].astype("string")
+        return pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+
+
+def make_sink(filename, columns, output_format, output_schema, compression, datetime_column=0):
+    if output_format == "csv":
+        return CsvSink(filename, columns, datetime_column)
+    if output_format not in ("parquet", "arrow"):
+        raise ValueError(f'UNKNOWN OUTPUT FORMAT "{output_format}".')
+    filename = os.path.splitext(filename)[0] + "." + output_format
+    return ArrowSink(filename, columns, output_schema, output_format, compression, datetime_column)
+
+
+class DriverPool:
+    # Warm Chrome instances shared by every browser step, health-checked on checkout and recycled after max_pages
+    def __init__(self, factory, size, max_pages):
+        self.factory = factory
+        self.max_pages = max_pages
+        self.idle = queue.Queue()
+        self.slots = threading.Semaphore(size)
+        self.pages = {}
+        self.lock = threading.Lock()
+
+    def healthy(self, driver):
+        try:
+            driver.execute_script("return 1;")
+            return True
+        except WebDriverException:
+            return False
+
+    def retire(self, driver):
+        with self.lock:
+            self.pages.pop(driver, None)
+        try:
+            driver.quit()
+        except WebDriverException:
+            pass
+
+    def acquire(self):
+        self.slots.acquire()
+        try:
+            while True:
+                try:
+                    driver = self.idle.get_nowait()
+                except queue.Empty:
+                    driver = self.factory()
+                    with self.lock:
+                        self.pages[driver] = 0
+                    return driver
+                if self.healthy(driver):
+                    return driver
+                logging.info("Replacing an unresponsive browser")
+                self.retire(driver)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def release(self, driver, broken=False):
+        with self.lock:
+            self.pages[driver] = self.pages.get(driver, 0) + 1
+            worn_out = self.pages[driver] >= self.max_pages
+        if broken or worn_out:
+            self.retire(driver)
+        else:
+            self.idle.put(driver)
+        self.slots.release()
+
+    @contextmanager
+    def driver(self):
+        driver = self.acquire()
+        broken = False
+        try:
+            yield driver
+        except WebDriverException:
+            broken = True
+            raise
+        finally:
+            self.release(driver, broken)
+
+    def close(self):
+        with self.lock:
+            drivers = list(self.pages)
+        for driver in drivers:
+            self.retire(driver)
+
+
+class BaseScraper:
+    # Session, request, parsing and output plumbing every project's Scraper inherits. The subclass provides
+    # make_session and sets rate_limiter, retry_policy, fixtures, timer and sink, plus cache when it passes
+    # cache=True, html_parser when it parses HTML and excel_engine when it reads workbooks.
+    cache = None
+
+    def __init__(self, pool_connections, pool_maxsize, headers=None, params=None):
+        self.session = None
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.session_headers = headers
+        self.session_params = params
+
+    def get_session(self):
+        # One keep-alive session per run, so every request reuses pooled connections
+        if self.session is None:
+            self.session = self.make_session(self.session_headers, self.session_params)
+            adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize)
+            self.session.mount("https://", adapter)
+            self.session.mount("http://", adapter)
+        return self.session
+
+    def close_session(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+    @timed("write")
+    def write_rows(self, df):
+        self.sink.write(df)
+
+    @timed("html_parse")
+    def make_soup(self, content, parse_only=None):
+        return BeautifulSoup(content, self.html_parser, parse_only=parse_only)
+
+    @timed("fetch")
+    def make_request(self, url, method="GET", max_retries=3, cache=False, **kwargs):
+        if self.fixtures.replaying:
+            return self.fixtures.load(method, url, kwargs.get("data"))
+
+        session = self.get_session()
+        if cache:
+            kwargs["headers"] = {**kwargs.get("headers", {}), **self.cache.validators(url)}
+        response = None
+        for attempt in range(max_retries + 1):
+            self.rate_limiter.wait(url)
+            try:
+                response = session.request(method, url, timeout = 90, **kwargs)
+                if response.status_code not in self.retry_policy.statuses:
+                    if cache:
+                        response = self.cache.update(url, response)
+                    self.fixtures.record(method, url, kwargs.get("data"), response)
+                    return response
+                error = f"status code {response.status_code}"
+            except requests.RequestException as e:
+                response = None
+                error = e
+
+            if attempt == max_retries:
+                break
+            delay = self.retry_policy.delay(attempt, response)
+            if delay is None:
+                logging.error(
+                    f"Error: {error}. {url} asked to retry after more than {self.retry_policy.retry_after_max} seconds"
+                )
+                break
+            if not self.retry_policy.take():
+                break
+            logging.error(f"Error: {error}. Retrying {url} in {delay:.1f} seconds...")
+            time.sleep(delay)
+
+        logging.error(f"Failed to retrieve data from {url} after {attempt + 1} attempts")
+        if response is None:
+            raise requests.RequestException(f"Request to {url} failed: {error}")
+        self.fixtures.record(method, url, kwargs.get("data"), response)
+        return response
+
+    @timed("excel_parse")
+    def load_excel(self, source, **kwargs):
+        # The engine always reads the whole sheet and pandas applies usecols afterwards, so only
+        # nrows (with skiprows) cuts the work, usecols just keeps the result small
+        try:
+            return pd.read_excel(source, engine=self.excel_engine, **kwargs)
+        except Exception as e:
+            if self.excel_engine is None:
+                raise
+            logging.warning(f"{self.excel_engine} could not read the workbook ({e}), retrying with the default engine")
+            if hasattr(source, "seek"):
+                source.seek(0)
+            return pd.read_excel(source, **kwargs)